@@ -56,6 +56,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -148,3 +149,20 @@ CORS_ALLOWED_ORIGINS = [
 
 # This setting tells Django where to collect all static files.
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# Pre-rendered API payloads written by load_battery_data.
+SNAPSHOT_DIR = os.environ.get(
+    'SNAPSHOT_DIR', os.path.join(BASE_DIR, 'snapshots'))
+
+# Largest response body, in bytes, that the read endpoints keep in the
+# response cache (see core/caching.py). Larger ones are rendered per request.
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get(
+    'RESPONSE_CACHE_MAX_BYTES', 8 * 2 ** 20))
+
+# Raw per-sample series kept by load_battery_data (see core/sample_store.py).
+SAMPLE_STORE_DIR = os.environ.get(
+    'SAMPLE_STORE_DIR', os.path.join(BASE_DIR, 'samples'))
+
+# Serve the battery endpoints from an in-memory copy of the dataset
+# (see core/memstore.py) instead of querying the database per request.
+IN_MEMORY_DATASET = os.environ.get('IN_MEMORY_DATASET') == 'true'
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "battery_project.settings")
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.IN_MEMORY_DATASET:
+    # Under gunicorn --preload this runs once in the master process, so the
+    # workers share the loaded arrays copy-on-write.
+    from core import memstore  # noqa: E402
+    memstore.preload()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Battery, CycleData
+from .models import Battery, CycleData, SourceFile
 
 
 class BatteryAdmin(admin.ModelAdmin):
@@ -15,5 +15,10 @@ class CycleDataAdmin(admin.ModelAdmin):
     list_filter = ('battery__voltage_type', 'battery')
 
 
+class SourceFileAdmin(admin.ModelAdmin):
+    list_display = ('path', 'size', 'parser_version', 'loaded_at')
+
+
 admin.site.register(Battery, BatteryAdmin)
 admin.site.register(CycleData, CycleDataAdmin)
+admin.site.register(SourceFile, SourceFileAdmin)
@@ -0,0 +1,328 @@
+"""
+Capacity-fade model fitting for many batteries at once.
+
+Each battery's usable discharge capacity series is normalized to its first
+usable cycle, giving the state of health as a fraction, and fitted against
+the number of cycles n since that cycle with three models:
+
+    linear              soh = a + b*n
+    power               soh = 1 - a*n**b
+    double_exponential  soh = a*exp(b*n) + c*exp(d*n)
+
+The series are padded into one (battery x cycle) matrix with a mask, so
+every model is fitted for all batteries with batched normal equations
+instead of a loop over batteries. The double exponential is only linear in
+a and c, so b and d are searched over a fixed grid of rates, with a and c
+solved in closed form for every pair of rates, and the best pair is then
+refined with a few damped Gauss-Newton steps on all four parameters. Fits
+whose rate ends up on the edge of the grid are discarded, as the true rate
+lies outside the range searched.
+
+Like `core.ingest`, this module does not touch the database.
+"""
+import numpy as np
+import pandas as pd
+
+# State of health (as a fraction) that counts as end of life.
+EOL_SOH = 0.8
+
+# Fewest usable cycles a battery needs before its fade is fitted.
+MIN_POINTS = 5
+
+# End of life is searched up to this multiple of the observed cycle span.
+EOL_HORIZON = 10
+
+# Candidate rates for the double exponential, half a decade apart: decays,
+# a constant term and slow growth for the knee some cells show late in life.
+# The first and last rates bound the refined fit.
+EXP_RATES = np.concatenate(
+    [-np.logspace(0, -5, 11), [0.0], np.logspace(-5, -2, 7)])
+
+# Damped Gauss-Newton steps that refine the best pair of rates on the grid.
+REFINE_STEPS = 20
+
+FIT_COLUMNS = ['fade_model', 'fade_params', 'fade_r2', 'predicted_eol_cycle']
+
+
+def pad_series(battery_ids, cycle_numbers, capacities):
+    """
+    Scatters flat (battery, cycle, capacity) arrays, sorted by battery and
+    cycle and holding usable cycles only, into padded matrices.
+
+    Returns (ids, first_cycle, n, soh, mask): the battery ids, each battery's
+    first usable cycle, and (battery x cycle) matrices of the cycles since
+    that one, the capacity relative to it, and which entries are real.
+    """
+    ids, starts, counts = np.unique(
+        battery_ids, return_index=True, return_counts=True)
+    rows = np.repeat(np.arange(len(ids)), counts)
+    cols = np.arange(len(battery_ids)) - np.repeat(starts, counts)
+
+    shape = (len(ids), counts.max() if len(ids) else 0)
+    n = np.zeros(shape)
+    soh = np.zeros(shape)
+    mask = np.zeros(shape, dtype=bool)
+
+    first_cycle = cycle_numbers[starts]
+    n[rows, cols] = cycle_numbers - first_cycle[rows]
+    soh[rows, cols] = capacities / capacities[starts][rows]
+    mask[rows, cols] = True
+    return ids, first_cycle, n, soh, mask
+
+
+def _solve2(s11, s12, s22, s1y, s2y):
+    """
+    Solves the 2x2 normal equations of y ~ p*x1 + q*x2 elementwise, given
+    the sums of x1*x1, x1*x2, x2*x2, x1*y and x2*y. Near-singular systems
+    give NaN.
+    """
+    det = s11 * s22 - s12 ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = (s22 * s1y - s12 * s2y) / det
+        q = (s11 * s2y - s12 * s1y) / det
+    singular = ~(np.abs(det) > 1e-10 * np.abs(s11 * s22))
+    p[singular] = np.nan
+    q[singular] = np.nan
+    return p, q
+
+
+def fit_linear(n, soh, mask):
+    w = mask.astype(float)
+    a, b = _solve2(
+        w.sum(axis=1), (w * n).sum(axis=1), (w * n ** 2).sum(axis=1),
+        (w * soh).sum(axis=1), (w * n * soh).sum(axis=1))
+    return np.column_stack([a, b])
+
+
+def predict_linear(params, n):
+    return params[:, 0:1] + params[:, 1:2] * n
+
+
+def fit_power(n, soh, mask):
+    # log(1 - soh) = log(a) + b*log(n), on the cycles that have faded.
+    w = (mask & (n > 0) & (soh < 1)).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = np.where(w > 0, np.log(n), 0.0)
+        v = np.where(w > 0, np.log(1 - soh), 0.0)
+    log_a, b = _solve2(
+        w.sum(axis=1), (w * u).sum(axis=1), (w * u ** 2).sum(axis=1),
+        (w * v).sum(axis=1), (w * u * v).sum(axis=1))
+    return np.column_stack([np.exp(log_a), b])
+
+
+def predict_power(params, n):
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        return 1 - params[:, 0:1] * n ** params[:, 1:2]
+
+
+def fit_double_exponential(n, soh, mask, chunk_size=256):
+    """
+    Grid search over pairs of EXP_RATES, in chunks of batteries to bound
+    memory, followed by a local refinement of the best pair. For every pair
+    the Gram matrix of the two basis curves gives both the amplitudes and
+    the residual sum of squares without forming the residuals.
+    """
+    first, second = np.triu_indices(len(EXP_RATES), 1)
+    params = np.full((len(n), 4), np.nan)
+
+    for start in range(0, len(n), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        w = mask[chunk].astype(float)
+        y = soh[chunk] * w
+        with np.errstate(over='ignore'):
+            basis = np.exp(EXP_RATES[:, None, None] * n[chunk][None]) * w
+        gram = np.einsum('rbk,sbk->rsb', basis, basis)
+        proj = np.einsum('rbk,bk->rb', basis, y)
+
+        s11, s12, s22 = gram[first, first], gram[first, second], gram[second, second]
+        s1y, s2y = proj[first], proj[second]
+        a, c = _solve2(s11, s12, s22, s1y, s2y)
+        sse = ((y ** 2).sum(axis=1)
+               - 2 * (a * s1y + c * s2y)
+               + a ** 2 * s11 + 2 * a * c * s12 + c ** 2 * s22)
+        sse[np.isnan(sse)] = np.inf
+
+        best = sse.argmin(axis=0)
+        rows = np.arange(len(best))
+        params[chunk] = _refine_double_exponential(np.column_stack([
+            a[best, rows], EXP_RATES[first[best]],
+            c[best, rows], EXP_RATES[second[best]],
+        ]), n[chunk], y, w)
+
+    rates = params[:, [1, 3]]
+    on_edge = (np.isclose(rates, EXP_RATES[0])
+               | np.isclose(rates, EXP_RATES[-1])).any(axis=1)
+    params[on_edge] = np.nan
+    return params
+
+
+def _amplitudes(rates, n, y, w):
+    """
+    Solves the least-squares a and c of each battery for its rates b and d.
+    """
+    with np.errstate(over='ignore', invalid='ignore'):
+        first = np.exp(rates[:, 0:1] * n) * w
+        second = np.exp(rates[:, 1:2] * n) * w
+        return np.column_stack(_solve2(
+            (first ** 2).sum(axis=1), (first * second).sum(axis=1),
+            (second ** 2).sum(axis=1), (first * y).sum(axis=1),
+            (second * y).sum(axis=1)))
+
+
+def _refine_double_exponential(params, n, y, w):
+    """
+    Levenberg-Marquardt steps on (a, b, c, d) for a chunk of batteries, with
+    the rates kept within the grid and a and c re-solved for the new rates.
+    A battery only takes a step that lowers its residual sum of squares; its
+    damping shrinks after such a step and grows after a rejected one, and it
+    drops out once its residual stops improving.
+    """
+    def residuals(params, rows):
+        return (y[rows] - predict_double_exponential(params, n[rows])) * w[rows]
+
+    sse = (residuals(params, slice(None)) ** 2).sum(axis=1)
+    damping = np.full(len(params), 1e-3)
+    active = np.isfinite(sse)
+    for _ in range(REFINE_STEPS):
+        rows = np.flatnonzero(active)
+        if not len(rows):
+            break
+        current, n_rows, w_rows = params[rows], n[rows], w[rows]
+        a, b, c, d = (current[:, i:i + 1] for i in range(4))
+        with np.errstate(over='ignore', invalid='ignore'):
+            exp_b, exp_d = np.exp(b * n_rows), np.exp(d * n_rows)
+            jacobian = np.stack(
+                [exp_b, a * n_rows * exp_b, exp_d, c * n_rows * exp_d],
+                axis=1) * w_rows[:, None]
+            jtj = jacobian @ jacobian.transpose(0, 2, 1)
+            jtr = (jacobian @ residuals(current, rows)[..., None])[..., 0]
+
+        diagonal = np.einsum('bii->bi', jtj)
+        jtj += np.einsum(
+            'bi,ij->bij', damping[rows, None] * diagonal + 1e-12, np.eye(4))
+        usable = np.isfinite(jtj).all(axis=(1, 2)) & np.isfinite(jtr).all(axis=1)
+        jtj[~usable] = np.eye(4)
+        jtr[~usable] = 0.0
+
+        candidate = current + np.linalg.solve(jtj, jtr[..., None])[..., 0]
+        candidate[:, [1, 3]] = candidate[:, [1, 3]].clip(EXP_RATES[0], EXP_RATES[-1])
+        candidate[:, [0, 2]] = _amplitudes(
+            candidate[:, [1, 3]], n_rows, y[rows], w_rows)
+        with np.errstate(over='ignore', invalid='ignore'):
+            candidate_sse = (residuals(candidate, rows) ** 2).sum(axis=1)
+
+        better = candidate_sse < sse[rows]
+        settled = ~better & (damping[rows] > 1e6)
+        settled |= better & (sse[rows] - candidate_sse <= 1e-9 * sse[rows])
+        params[rows[better]] = candidate[better]
+        sse[rows[better]] = candidate_sse[better]
+        damping[rows] = np.where(better, damping[rows] / 10, damping[rows] * 10)
+        active[rows[settled]] = False
+    return params
+
+
+def predict_double_exponential(params, n):
+    with np.errstate(over='ignore', invalid='ignore'):
+        return (params[:, 0:1] * np.exp(params[:, 1:2] * n)
+                + params[:, 2:3] * np.exp(params[:, 3:4] * n))
+
+
+# name -> (fit, predict, parameter names)
+MODELS = {
+    'linear': (fit_linear, predict_linear, ('a', 'b')),
+    'power': (fit_power, predict_power, ('a', 'b')),
+    'double_exponential': (
+        fit_double_exponential, predict_double_exponential, ('a', 'b', 'c', 'd')),
+}
+
+
+def r_squared(predicted, soh, mask):
+    """
+    Returns the R² of each battery's fit, measured in SOH space over its
+    usable cycles, and the number of those cycles.
+    """
+    points = mask.sum(axis=1)
+    mean = (soh * mask).sum(axis=1) / np.maximum(points, 1)
+    sst = (((soh - mean[:, None]) * mask) ** 2).sum(axis=1)
+    with np.errstate(invalid='ignore'):
+        sse = (np.where(mask, soh - predicted, 0.0) ** 2).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2 = np.where(sst > 0, 1 - sse / sst, np.where(sse == 0, 1.0, 0.0))
+    return r2, points
+
+
+def eol_cycles(predict, params, span, samples=512, iterations=40):
+    """
+    Returns the first n at which each fitted curve drops to EOL_SOH, searched
+    on a grid up to EOL_HORIZON times `span` and refined by bisection. NaN
+    where the curve stays above EOL_SOH over that range.
+    """
+    horizon = np.maximum(span, 1) * EOL_HORIZON
+    grid = horizon[:, None] * np.linspace(0, 1, samples)[None]
+    below = predict(params, grid) <= EOL_SOH
+
+    found = below.any(axis=1)
+    index = below.argmax(axis=1)
+    rows = np.arange(len(grid))
+    high = grid[rows, index]
+    low = grid[rows, np.maximum(index - 1, 0)]
+
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        middle_below = predict(params, middle[:, None])[:, 0] <= EOL_SOH
+        high = np.where(middle_below, middle, high)
+        low = np.where(middle_below, low, middle)
+    return np.where(found, high, np.nan)
+
+
+def fit_fade_models(battery_ids, cycle_numbers, capacities):
+    """
+    Fits every model to every battery and keeps the best one per battery by
+    adjusted R². Takes flat arrays as described in `pad_series` and returns
+    a DataFrame indexed by battery id with FIT_COLUMNS. Batteries with fewer
+    than MIN_POINTS usable cycles get no fit.
+    """
+    ids, first_cycle, n, soh, mask = pad_series(
+        np.asarray(battery_ids), np.asarray(cycle_numbers, dtype=float),
+        np.asarray(capacities, dtype=float))
+    fits = pd.DataFrame(index=pd.Index(ids, name='id'), columns=FIT_COLUMNS)
+    if not len(ids):
+        return fits
+
+    span = np.where(mask, n, 0).max(axis=1)
+    best_score = np.full(len(ids), -np.inf)
+    best_model = np.full(len(ids), None, dtype=object)
+    best_params = np.full(len(ids), None, dtype=object)
+    best_r2 = np.full(len(ids), np.nan)
+    best_eol = np.full(len(ids), np.nan)
+
+    for name, (fit, predict, param_names) in MODELS.items():
+        params = fit(n, soh, mask)
+        r2, points = r_squared(predict(params, n), soh, mask)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = 1 - (1 - r2) * (points - 1) / (points - len(param_names))
+        score[~np.isfinite(score) | np.isnan(params).any(axis=1)
+              | (points < MIN_POINTS)] = -np.inf
+
+        better = score > best_score
+        if not better.any():
+            continue
+        best_score[better] = score[better]
+        best_model[better] = name
+        best_params[better] = [
+            {key: float(f'{value:.6g}') for key, value in zip(param_names, row)}
+            for row in params[better]
+        ]
+        best_r2[better] = r2[better].round(4)
+        best_eol[better] = first_cycle[better] + np.ceil(
+            eol_cycles(predict, params[better], span[better]))
+
+    fits['fade_model'] = best_model
+    fits['fade_params'] = best_params
+    fits['fade_r2'] = pd.Series(
+        [None if np.isnan(r2) else float(r2) for r2 in best_r2],
+        index=fits.index, dtype=object)
+    fits['predicted_eol_cycle'] = pd.Series(
+        [None if np.isnan(eol) else int(eol) for eol in best_eol],
+        index=fits.index, dtype=object)
+    return fits
@@ -0,0 +1,110 @@
+"""
+Async versions of the read endpoints, for deployments served over ASGI
+(`battery_project.asgi`). They use Django's async ORM directly instead of
+DRF, which has no async views, and produce the same JSON as the default
+`rows` layout of the DRF endpoints.
+
+The battery list is streamed: one battery is encoded and sent at a time
+while a single cursor walks the cycles in battery order, so memory per
+request stays flat however many batteries a voltage type holds.
+
+The async ORM cannot run a request in one transaction, so these views are
+not pinned to one dataset generation: a response that overlaps a load's
+commit may mix the two generations.
+"""
+import json
+
+from django.http import JsonResponse, StreamingHttpResponse
+
+from .metrics import serializing
+from .models import Battery, CycleData
+from .serializers import BatterySerializer, BatterySummarySerializer
+from .series import SERIES_FIELDS
+
+# Rows fetched per round trip by the cycle cursor.
+CYCLE_CHUNK_SIZE = 2000
+
+
+def _dumps(data):
+    # Same output as DRF's JSONRenderer with its default settings.
+    return json.dumps(
+        data, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+
+
+def _json_response(data, status=200):
+    with serializing():
+        return JsonResponse(data, safe=False, status=status, json_dumps_params={
+            'ensure_ascii': False, 'allow_nan': False, 'separators': (',', ':')})
+
+
+async def battery_summary(request):
+    """
+    Async counterpart of `BatterySummaryView`.
+    """
+    fields = BatterySummarySerializer.Meta.fields
+    batteries = Battery.objects.order_by(
+        'voltage_type', 'battery_number').values(*fields)
+    return _json_response([battery async for battery in batteries])
+
+
+async def battery_detail(request, voltage_type, battery_number):
+    """
+    Async counterpart of `BatteryDetail`.
+    """
+    try:
+        battery = await Battery.objects.aget(
+            voltage_type=voltage_type, battery_number=battery_number)
+    except Battery.DoesNotExist:
+        return _json_response(
+            {'detail': 'No Battery matches the given query.'}, status=404)
+
+    cycles = CycleData.objects.filter(battery=battery).order_by(
+        'cycle_number').values(*SERIES_FIELDS)
+    return _json_response({
+        'id': battery.id,
+        'file_name': battery.file_name,
+        'cycle_count': battery.cycle_count,
+        'cycles': [cycle async for cycle in cycles],
+    })
+
+
+async def battery_list(request, voltage_type):
+    """
+    Async, streamed counterpart of `BatteryList`. Batteries are sent in id
+    order.
+    """
+    return StreamingHttpResponse(
+        _stream_batteries(voltage_type), content_type='application/json')
+
+
+async def _stream_batteries(voltage_type):
+    batteries = [
+        row async for row in Battery.objects.filter(
+            voltage_type=voltage_type
+        ).order_by('pk').values_list(*BatterySerializer.Meta.fields[:-1])
+    ]
+    # values() rather than values_list(): only the former's iterable defers
+    # running the query until the cursor is read in a worker thread.
+    cycles = CycleData.objects.filter(
+        battery__voltage_type=voltage_type
+    ).order_by('battery_id', 'cycle_number').values(
+        'battery_id', *SERIES_FIELDS
+    ).aiterator(chunk_size=CYCLE_CHUNK_SIZE)
+
+    # Both sides are ordered by battery id, so the cycles of each battery
+    # are the next run of rows from the cursor.
+    pending = await anext(cycles, None)
+    yield '['
+    for index, (battery_id, file_name, cycle_count) in enumerate(batteries):
+        battery_cycles = []
+        while pending is not None and pending['battery_id'] == battery_id:
+            battery_cycles.append(
+                {field: pending[field] for field in SERIES_FIELDS})
+            pending = await anext(cycles, None)
+        yield (',' if index else '') + _dumps({
+            'id': battery_id,
+            'file_name': file_name,
+            'cycle_count': cycle_count,
+            'cycles': battery_cycles,
+        })
+    yield ']'
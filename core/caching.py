@@ -0,0 +1,185 @@
+"""
+HTTP caching for the read endpoints.
+
+The data only changes when `load_battery_data` runs, so every response is a
+pure function of the dataset version, the request path (with its query
+string) and the negotiated content type and encoding. Responses are cached
+under that key, carry an ETag and Last-Modified derived from it, and
+conditional requests are answered with 304 Not Modified without running the
+view. Plain JSON requests are served from the snapshots materialized by the
+loader whenever one exists.
+"""
+import hashlib
+import threading
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers)
+from django.utils.http import http_date
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .dataset import consistent_read, dataset_version
+from .metrics import render
+from .renderers import BINARY_RENDERERS
+from .snapshots import read_snapshot
+
+# Request headers, besides the URL, that select the response.
+VARY_HEADERS = ('Accept', 'Accept-Encoding')
+
+# Response headers worth keeping in the cached copy.
+CACHED_HEADERS = ('Content-Type', 'Vary', 'Allow', 'Content-Language')
+
+# Every renderer an endpoint with snapshots can negotiate to.
+SNAPSHOT_RENDERERS = [*api_settings.DEFAULT_RENDERER_CLASSES, *BINARY_RENDERERS]
+
+_negotiation = DefaultContentNegotiation()
+_lock = threading.Lock()
+_cached_version = None
+_cached_keys = set()
+
+
+def dataset_cached(view_func):
+    """
+    Wraps a view so GET/HEAD responses are cached per dataset version and
+    served with ETag / Last-Modified validators.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return _run_view(view_func, request, *args, **kwargs)[0]
+
+        # One indexed query outside any transaction. A 304, a snapshot or a
+        # cached body needs nothing else from the database.
+        version = dataset_version()
+        if version is None:
+            # Nothing loaded yet, so there is nothing to key the cache on.
+            return _run_view(view_func, request, *args, **kwargs)[0]
+        _evict_stale(version)
+
+        variant = '\n'.join([
+            version,
+            request.get_full_path(),
+            request.META.get('HTTP_ACCEPT', ''),
+            request.META.get('HTTP_ACCEPT_ENCODING', ''),
+        ])
+        digest = hashlib.sha256(variant.encode()).hexdigest()[:32]
+        etag = f'"{digest}"'
+        last_modified = _version_timestamp(version)
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None and _accepts_snapshot(request):
+            response = _snapshot_response(request, version)
+        cache_result = 'hit'
+        if response is None:
+            key = f'response:{digest}'
+            cached = cache.get(key)
+            if cached is None:
+                cache_result = 'miss'
+                response, view_version = _run_view(
+                    view_func, request, *args, **kwargs)
+                if view_version != version:
+                    # A load was published since the version was read, so
+                    # the body belongs to neither this key nor this ETag.
+                    response.cache_result = cache_result
+                    return response
+                # A body over the limit would crowd the rest out of the
+                # cache, so it is rendered again on every request.
+                if (response.status_code == 200 and len(response.content)
+                        <= settings.RESPONSE_CACHE_MAX_BYTES):
+                    cache.set(key, (response.content, {
+                        header: response[header]
+                        for header in CACHED_HEADERS if response.has_header(header)
+                    }), timeout=None)
+                    with _lock:
+                        _cached_keys.add(key)
+            else:
+                content, headers = cached
+                response = HttpResponse(content, headers=headers)
+
+        # Read by the metrics middleware.
+        response.cache_result = cache_result
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # Also on a 304, which stands in for the full response.
+        patch_vary_headers(response, VARY_HEADERS)
+        # Clients may reuse the response, but must revalidate it first.
+        patch_cache_control(response, no_cache=True)
+        return response
+
+    return wrapper
+
+
+def _run_view(view_func, request, *args, **kwargs):
+    """
+    Runs and renders the view in a consistent read, so every row it reads
+    comes from one dataset generation. Returns the response and the version
+    of that generation.
+    """
+    with consistent_read():
+        response = view_func(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            render(response)
+        return response, dataset_version()
+
+
+def _accepts_snapshot(request):
+    """
+    Snapshots hold the default JSON rendering, so they only answer requests
+    without query parameters whose Accept header DRF would negotiate to the
+    JSON renderer, the way the views themselves negotiate.
+    """
+    if request.GET:
+        return False
+    try:
+        renderer, _ = _negotiation.select_renderer(
+            Request(request), [renderer() for renderer in SNAPSHOT_RENDERERS])
+    except NotAcceptable:
+        return False
+    return type(renderer) is JSONRenderer
+
+
+def _snapshot_response(request, version):
+    snapshot = read_snapshot(
+        version, request.path, request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if snapshot is None:
+        return None
+    content, encoding = snapshot
+    response = HttpResponse(content, content_type='application/json', headers={
+        'Allow': 'GET, HEAD, OPTIONS',
+    })
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
+
+
+def _evict_stale(version):
+    """
+    Drops the responses this process cached for an older dataset version.
+    Their keys can never be requested again, so this only frees memory.
+    """
+    global _cached_version
+    if version == _cached_version:
+        return
+    with _lock:
+        if version != _cached_version:
+            if _cached_keys:
+                cache.delete_many(list(_cached_keys))
+                _cached_keys.clear()
+            _cached_version = version
+
+
+def _version_timestamp(version):
+    try:
+        return int(datetime.fromisoformat(version).timestamp())
+    except ValueError:
+        return None
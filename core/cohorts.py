@@ -0,0 +1,137 @@
+"""
+Statistics over cohorts of batteries that share a voltage type, C-rate
+and/or stress test.
+"""
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+
+from .dataset import dataset_version
+from .models import Battery, CycleData
+
+COHORT_FIELDS = ['voltage_type', 'c_rate', 'stress_test']
+
+# Battery fields summarized per cohort.
+COHORT_STATISTICS = ['state_of_health', 'cycle_count', 'overall_avg_temp']
+
+# Two-sided 95% normal quantile, for the band around the mean fade curve.
+CONFIDENCE_Z = 1.96
+
+
+def cohort_statistics(group_by):
+    """
+    Groups the batteries by the `group_by` fields (a subset of
+    COHORT_FIELDS) and returns one dict per cohort with its battery count,
+    the mean/median/p10/p90 of COHORT_STATISTICS, and its mean fade curve.
+
+    The fade curve is the capacity relative to each battery's first usable
+    cycle, averaged per cycle number over the cohort's batteries, with a
+    95% confidence band for that mean (null where fewer than two batteries
+    reached the cycle). Everything is computed from two queries with
+    vectorized grouping, and cached per dataset version once one has been
+    published.
+    """
+    version = dataset_version()
+    key = f"cohorts:{','.join(group_by)}:{version}"
+    cached = cache.get(key) if version is not None else None
+    if cached is not None:
+        return cached
+
+    batteries = pd.DataFrame.from_records(
+        Battery.objects.order_by('pk').values('id', *group_by, *COHORT_STATISTICS),
+        columns=['id', *group_by, *COHORT_STATISTICS],
+    )
+    if batteries.empty:
+        return []
+    # Columns that are entirely null come back as object dtype, which the
+    # quantiles below reject.
+    batteries[COHORT_STATISTICS] = batteries[COHORT_STATISTICS].astype(float)
+    batteries['cohort'] = batteries.groupby(
+        group_by, dropna=False, sort=True).ngroup()
+    cohorts = batteries.drop_duplicates('cohort').sort_values('cohort')
+
+    grouped = batteries.groupby('cohort')[COHORT_STATISTICS]
+    stats = {
+        'mean': grouped.mean(),
+        'median': grouped.median(),
+        'p10': grouped.quantile(0.1),
+        'p90': grouped.quantile(0.9),
+    }
+    sizes = batteries.groupby('cohort').size()
+    curves = _fade_curves(batteries.set_index('id')['cohort'], len(cohorts))
+
+    result = []
+    for cohort in cohorts.itertuples(index=False):
+        entry = {}
+        for field in group_by:
+            value = getattr(cohort, field)
+            entry[field] = None if pd.isna(value) else value
+        entry['count'] = int(sizes[cohort.cohort])
+        for field in COHORT_STATISTICS:
+            entry[field] = {
+                name: _clean(frame.loc[cohort.cohort, field])
+                for name, frame in stats.items()
+            }
+        entry['fade_curve'] = curves[cohort.cohort]
+        result.append(entry)
+
+    if version is not None:
+        cache.set(key, result, timeout=None)
+    return result
+
+
+def _fade_curves(cohort_of_battery, cohort_count):
+    """
+    Accumulates the per-cycle count, sum and sum of squares of every
+    battery's relative capacity into (cohort x cycle) matrices with
+    `np.bincount`, then derives the mean curve and confidence band.
+    """
+    rows = np.array(
+        list(CycleData.objects.filter(discharge_capacity__gt=0)
+             .order_by('battery_id', 'cycle_number')
+             .values_list('battery_id', 'cycle_number', 'discharge_capacity')),
+        dtype=float,
+    ).reshape(-1, 3)
+    battery_ids = rows[:, 0].astype(np.int64)
+
+    # Rows are sorted by battery, so each battery's first row is its first
+    # usable cycle.
+    _, starts, counts = np.unique(
+        battery_ids, return_index=True, return_counts=True)
+    relative = rows[:, 2] / np.repeat(rows[starts, 2], counts)
+
+    cycles, columns = np.unique(rows[:, 1].astype(np.int64), return_inverse=True)
+    cohorts = cohort_of_battery.reindex(battery_ids).to_numpy()
+    flat = cohorts * len(cycles) + columns
+    size = cohort_count * len(cycles)
+    shape = (cohort_count, len(cycles))
+
+    n = np.bincount(flat, minlength=size).reshape(shape)
+    total = np.bincount(flat, relative, minlength=size).reshape(shape)
+    total_sq = np.bincount(flat, relative ** 2, minlength=size).reshape(shape)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / n
+        variance = np.maximum(total_sq - n * mean ** 2, 0) / (n - 1)
+        margin = CONFIDENCE_Z * np.sqrt(variance / n)
+    margin[n < 2] = np.nan
+
+    curves = []
+    for cohort in range(cohort_count):
+        present = n[cohort] > 0
+        curves.append({
+            'cycle_number': cycles[present].tolist(),
+            'count': n[cohort, present].tolist(),
+            'mean': _clean_list(mean[cohort, present]),
+            'lower': _clean_list((mean - margin)[cohort, present]),
+            'upper': _clean_list((mean + margin)[cohort, present]),
+        })
+    return curves
+
+
+def _clean(value):
+    return None if pd.isna(value) else round(float(value), 4)
+
+
+def _clean_list(values):
+    return np.where(np.isfinite(values), values.round(4), None).tolist()
@@ -0,0 +1,120 @@
+"""
+Tracks the version of the loaded dataset.
+
+`load_battery_data` writes each new generation of the data in one database
+transaction and publishes it by adding a `DatasetVersion` row in that same
+transaction. Readers therefore see either the previous generation or the
+new one, never a mix. Anything derived from the database can be cached
+under the current version and is invalidated by the next load.
+
+A read endpoint that queries the data does so inside `consistent_read`,
+which reads the version once in a transaction that sees a single
+snapshot, so the version and every row it reads come from the same
+generation.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import DatasetVersion
+
+# Published versions kept in the database.
+KEEP_VERSIONS = 10
+
+_UNPINNED = object()
+_pinned = ContextVar('dataset_version', default=_UNPINNED)
+
+
+def dataset_version():
+    """
+    Returns the version of the current dataset generation, or None if the
+    loader has never run.
+    """
+    pinned = _pinned.get()
+    if pinned is not _UNPINNED:
+        return pinned
+    return DatasetVersion.objects.order_by('-pk').values_list(
+        'version', flat=True).first()
+
+
+@contextmanager
+def pin_dataset_version():
+    """
+    Reads the current version once and returns it from every
+    `dataset_version()` call inside the block.
+    """
+    token = _pinned.set(dataset_version())
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+@contextmanager
+def consistent_read():
+    """
+    Runs the block in a transaction that reads a single snapshot of the
+    database, with the version pinned. SQLite read transactions always see
+    one snapshot; on PostgreSQL this transaction alone is raised to
+    REPEATABLE READ.
+    """
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        if outermost and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        with pin_dataset_version():
+            yield
+
+
+def next_dataset_version():
+    """
+    Returns a fresh version string for a load that is about to be published.
+    """
+    return timezone.now().isoformat()
+
+
+def publish_dataset_version(version=None):
+    """
+    Publishes a new version and returns it. Called in the transaction that
+    wrote the data, the version becomes visible together with that data when
+    the transaction commits. Only the newest KEEP_VERSIONS versions are kept.
+
+    The cache is left alone: every cached value is keyed by the version it
+    was computed for, so the new version simply misses the old entries.
+    `core.caching` deletes the responses a process cached for older
+    versions, and other entries age out of the cache backend.
+    """
+    version = version or next_dataset_version()
+    DatasetVersion.objects.create(version=version)
+    stale = DatasetVersion.objects.order_by('-pk').values_list(
+        'pk', flat=True)[KEEP_VERSIONS:]
+    DatasetVersion.objects.filter(pk__in=list(stale)).delete()
+    return version
+
+
+def use_write_ahead_log():
+    """
+    On SQLite, switches the database file to write-ahead logging, so readers
+    keep reading the previous generation while a load writes instead of
+    waiting for its lock. The mode is stored in the file, so it only has to
+    be set once. Does nothing on other databases, or inside a transaction,
+    where SQLite cannot change the journal mode.
+    """
+    if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL')
+
+
+def checkpoint_database():
+    """
+    On SQLite, copies the write-ahead log back into the database file and
+    truncates it, which frees the pages of older generations once their
+    readers are done. Does nothing on other databases, or inside a
+    transaction, where the checkpoint would fail on the transaction's locks.
+    """
+    if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
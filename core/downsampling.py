@@ -0,0 +1,51 @@
+"""
+Shape-preserving downsampling of cycle series for charting.
+"""
+import numpy as np
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: returns the indices of `threshold`
+    points of (x, y) that best preserve the visual shape of the series.
+    The first and last points are always kept.
+
+    Bucket boundaries and bucket means are computed for all buckets at once;
+    only the choice of each bucket's point, which depends on the point picked
+    in the previous bucket, runs per bucket.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Interior points 1..n-2 are split into threshold - 2 buckets.
+    every = (n - 2) / (threshold - 2)
+    bounds = (np.arange(threshold - 1) * every).astype(int) + 1
+    bounds[-1] = n - 1
+    starts, ends = bounds[:-1], bounds[1:]
+
+    # Mean point of every bucket, followed by the last point, which plays the
+    # role of the "next bucket" for the final bucket.
+    cum_x = np.concatenate(([0.0], np.cumsum(x)))
+    cum_y = np.concatenate(([0.0], np.cumsum(y)))
+    counts = ends - starts
+    mean_x = np.append((cum_x[ends] - cum_x[starts]) / counts, x[-1])
+    mean_y = np.append((cum_y[ends] - cum_y[starts]) / counts, y[-1])
+
+    selected = np.empty(threshold, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        # Twice the area of the triangle (a, candidate, next bucket mean).
+        area = np.abs(
+            (x[a] - mean_x[i + 1]) * (bucket_y - y[a])
+            - (x[a] - bucket_x) * (mean_y[i + 1] - y[a])
+        )
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
@@ -0,0 +1,182 @@
+"""
+Parsing helpers for the UL cycle-life Excel workbooks.
+
+These functions do not touch the database so they can run inside worker
+processes; `load_battery_data` collects their results and does all writes.
+"""
+import os
+import re
+import time
+import tracemalloc
+
+import pandas as pd
+
+from core.parse_cache import DEFAULT_CACHE_DIR, file_digest, iter_sheets
+from core.profiling import peak_rss_mb
+from core.sample_store import SAMPLE_CHANNELS, SampleWriter, entry_dir
+
+VOLTAGE_DIRS = {
+    'normal': os.path.join('data', 'normal_voltage'),
+    'reduced': os.path.join('data', 'reduced_voltage'),
+}
+
+EXCEL_EXTENSIONS = ('.xls', '.xlsx')
+
+# Raw columns the per-cycle aggregation needs; everything else is dropped as
+# soon as a sheet is read.
+SAMPLE_COLUMNS = [
+    'Cycle_Index',
+    'Discharge_Capacity(Ah)',
+    'Charge_Capacity(Ah)',
+    'Current(A)',
+    'Voltage(V)',
+    'Temperature (C)_1',
+]
+
+# Partial aggregates computed per sheet, and how to fold them together when
+# a cycle spans more than one sheet.
+PARTIAL_AGGREGATES = {
+    'discharge_capacity': ('Discharge_Capacity(Ah)', 'max', 'max'),
+    'charge_capacity': ('Charge_Capacity(Ah)', 'max', 'max'),
+    'current_sum': ('Current(A)', 'sum', 'sum'),
+    'current_count': ('Current(A)', 'count', 'sum'),
+    'voltage_sum': ('Voltage(V)', 'sum', 'sum'),
+    'voltage_count': ('Voltage(V)', 'count', 'sum'),
+    'temp_sum': ('Temperature (C)_1', 'sum', 'sum'),
+    'temp_count': ('Temperature (C)_1', 'count', 'sum'),
+    'max_temp': ('Temperature (C)_1', 'max', 'max'),
+    'min_temp': ('Temperature (C)_1', 'min', 'min'),
+}
+
+# Bump whenever `summarize_workbook` changes the values it produces, so the
+# next load re-parses files that were ingested by the old logic.
+PARSER_VERSION = 2
+
+
+def parse_file_name(filename):
+    """
+    Extracts the battery metadata encoded in a file name,
+    e.g. 'Ba01_N20_OV1_300, 20% CF, 300 Cycles.xls'.
+    """
+    parts = filename.split('_')
+    match = re.search(r'B[ab](\d+)_', filename)
+    return {
+        'battery_number': int(match.group(1)) if match else None,
+        'c_rate': parts[1] if len(parts) > 1 else None,
+        'stress_test': parts[2] if len(parts) > 2 else None,
+    }
+
+
+def summarize_workbook(file_path, content_hash=None, cache_dir=DEFAULT_CACHE_DIR,
+                       sample_dir=None, trace_memory=False):
+    """
+    Streams the sheets of a workbook (through the parse cache unless
+    `cache_dir` is None) and aggregates the raw samples into one row per
+    cycle. Only one sheet's sample columns are held in memory at a time.
+    Returns a DataFrame with a `Cycle_Index` column followed by the
+    CycleData fields.
+
+    With `sample_dir`, the raw samples are also written to the sample store
+    there, unless the workbook is already in it.
+
+    The number of sample rows read and the seconds spent reading sheets,
+    storing samples and aggregating are recorded in the result's
+    `attrs['profile']`, along with the peak resident set size of the process
+    that parsed it, as of the end of the parse. With `trace_memory`, the
+    peak Python allocation of the parse is recorded too.
+    """
+    clock = time.perf_counter
+    profile = {
+        'rows': 0,
+        'read_seconds': 0.0,
+        'sample_seconds': 0.0,
+        'aggregate_seconds': 0.0,
+    }
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    elif trace_memory:
+        tracemalloc.reset_peak()
+
+    columns = SAMPLE_COLUMNS
+    writer = None
+    if sample_dir is not None:
+        content_hash = content_hash or file_digest(file_path)
+        if not os.path.isdir(entry_dir(sample_dir, content_hash)):
+            writer = SampleWriter(sample_dir, content_hash)
+            columns = list(dict.fromkeys(
+                [*SAMPLE_COLUMNS, *SAMPLE_CHANNELS.values()]))
+
+    partials = []
+    try:
+        started = clock()
+        for sheet in iter_sheets(file_path, content_hash, cache_dir, columns):
+            now = clock()
+            profile['read_seconds'] += now - started
+            if 'Cycle_Index' in sheet.columns:
+                profile['rows'] += len(sheet)
+                if writer is not None:
+                    writer.add(sheet)
+                    profile['sample_seconds'] += clock() - now
+                    now = clock()
+                partials.append(summarize_sheet(sheet))
+                profile['aggregate_seconds'] += clock() - now
+            started = clock()
+        if writer is not None:
+            now = clock()
+            writer.commit()
+            profile['sample_seconds'] += clock() - now
+    finally:
+        if writer is not None:
+            writer.discard()
+
+    now = clock()
+    if partials:
+        folded = pd.concat(partials).groupby(level=0).agg(
+            {name: fold for name, (_, _, fold) in PARTIAL_AGGREGATES.items()})
+    else:
+        folded = pd.DataFrame(
+            columns=list(PARTIAL_AGGREGATES), index=pd.Index([], dtype=int))
+
+    def mean(prefix):
+        return folded[f'{prefix}_sum'] / folded[f'{prefix}_count'].where(
+            folded[f'{prefix}_count'] > 0)
+
+    summary = pd.DataFrame({
+        'Cycle_Index': folded.index.astype(int),
+        'discharge_capacity': folded['discharge_capacity'],
+        'charge_capacity': folded['charge_capacity'],
+        'avg_current': mean('current'),
+        'avg_voltage': mean('voltage'),
+        'avg_temp': mean('temp'),
+        'max_temp': folded['max_temp'],
+        'min_temp': folded['min_temp'],
+    }).reset_index(drop=True)
+    profile['aggregate_seconds'] += clock() - now
+    # Measured here because a worker is not a child of the loader but of its
+    # fork server, so the loader cannot see the worker's usage.
+    profile['peak_rss_mb'] = peak_rss_mb()
+    if trace_memory:
+        profile['tracemalloc_peak_mb'] = round(
+            tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        if started_tracing:
+            tracemalloc.stop()
+    summary.attrs['profile'] = profile
+    return summary
+
+
+def summarize_sheet(sheet):
+    """
+    Reduces one sheet to partial per-cycle aggregates (see
+    PARTIAL_AGGREGATES), indexed by cycle number.
+    """
+    sheet = sheet.reindex(columns=SAMPLE_COLUMNS)
+    cycle_index = pd.to_numeric(sheet['Cycle_Index'], errors='coerce')
+    valid = cycle_index.notna()
+    sheet = sheet[valid].assign(
+        Cycle_Index=cycle_index[valid].astype('int32'))
+
+    return sheet.groupby('Cycle_Index').agg(**{
+        name: (column, func)
+        for name, (column, func, _) in PARTIAL_AGGREGATES.items()
+    })
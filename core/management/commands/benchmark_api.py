@@ -0,0 +1,305 @@
+import json
+import os
+import platform
+import tempfile
+import time
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext, setup_test_environment, teardown_test_environment)
+from django.urls import reverse
+from django.utils import timezone
+
+from core import dataset
+from core.models import Battery, CycleData, DatasetVersion, SourceFile
+from core.sample_store import SAMPLE_CHANNELS, SampleWriter
+from core.snapshots import materialize_snapshots
+
+C_RATES = ['N10', 'N15', 'N20', 'R10', 'R15', 'R20']
+STRESS_TESTS = ['OV1', 'EX2', 'UV1', 'CF1']
+PERCENTILES = (50, 95, 99)
+
+# Raw samples per cycle stored for the first battery, for the samples
+# endpoint.
+SAMPLES_PER_CYCLE = 100
+
+# Statements added by transaction handling rather than by the view, left
+# out of queries_per_request.
+TRANSACTION_STATEMENTS = (
+    'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT')
+
+
+class Command(BaseCommand):
+    """
+    Seeds a throwaway test database with synthetic batteries and cycles,
+    drives every read endpoint in-process with the Django test client and
+    reports latency percentiles, throughput, queries and response size per
+    endpoint.
+    """
+    help = 'Benchmarks the read API against a synthetic dataset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batteries', type=int, default=20,
+            help='Number of synthetic batteries to seed.')
+        parser.add_argument(
+            '--cycles', type=int, default=300,
+            help='Number of cycles per synthetic battery.')
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Timed requests per endpoint.')
+        parser.add_argument(
+            '--warmup', type=int, default=3,
+            help='Untimed requests per endpoint before timing starts.')
+        parser.add_argument(
+            '--cached', action='store_true',
+            help='Publish a dataset version and materialize snapshots '
+                 'first, so the response cache is exercised. By default any '
+                 'version is removed and every request runs the view.')
+        parser.add_argument(
+            '--in-memory', action='store_true',
+            help='Benchmark with IN_MEMORY_DATASET enabled.')
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed for the synthetic data.')
+        parser.add_argument(
+            '--output',
+            help='Write the results as JSON to this path.')
+
+    def handle(self, *args, **options):
+        if options['batteries'] < 1 or options['cycles'] < 1 or options['requests'] < 1:
+            raise CommandError(
+                '--batteries, --cycles and --requests must be at least 1.')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True)
+        try:
+            with tempfile.TemporaryDirectory() as work_dir, \
+                    override_settings(
+                        SNAPSHOT_DIR=os.path.join(work_dir, 'snapshots'),
+                        SAMPLE_STORE_DIR=os.path.join(work_dir, 'samples'),
+                        IN_MEMORY_DATASET=options['in_memory']):
+                # Without a version, dataset_cached runs the view on every
+                # request.
+                DatasetVersion.objects.all().delete()
+                cache.clear()
+                self.seed(options['batteries'], options['cycles'], options['seed'])
+                if options['cached']:
+                    version = dataset.publish_dataset_version()
+                    materialize_snapshots(version)
+                results = self.run_benchmark(options['requests'], options['warmup'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.print_table(results)
+        if options['output']:
+            report = {
+                'created': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'options': {
+                    key: options[key] for key in (
+                        'batteries', 'cycles', 'requests', 'warmup',
+                        'cached', 'in_memory', 'seed')
+                },
+                'endpoints': results,
+            }
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f"Results written to {options['output']}"))
+
+    def seed(self, battery_count, cycle_count, seed):
+        """
+        Creates `battery_count` batteries with `cycle_count` cycles each,
+        following a noisy power-law capacity fade.
+        """
+        rng = np.random.default_rng(seed)
+        self.stdout.write(
+            f"Seeding {battery_count} batteries x {cycle_count} cycles...")
+
+        batteries = Battery.objects.bulk_create([
+            Battery(
+                file_name=f'Bench{index:05d}.xls',
+                battery_number=index // 2 + 1,
+                voltage_type=('normal', 'reduced')[index % 2],
+                cycle_count=cycle_count,
+                c_rate=C_RATES[index % len(C_RATES)],
+                stress_test=STRESS_TESTS[index % len(STRESS_TESTS)],
+                state_of_health=round(float(rng.uniform(10, 100)), 2),
+                overall_avg_temp=round(float(rng.uniform(20, 35)), 2),
+                overall_avg_discharge=round(float(rng.uniform(1, 3)), 2),
+                durability_score=round(float(rng.uniform()), 4),
+                resilience_score=round(float(rng.uniform()), 4),
+                balanced_score=round(float(rng.uniform()), 4),
+            )
+            for index in range(battery_count)
+        ], batch_size=1000)
+
+        cycle_numbers = np.arange(1, cycle_count + 1)
+        for battery in batteries:
+            fade = rng.uniform(0.001, 0.02) * cycle_numbers ** rng.uniform(0.5, 1.0)
+            discharge = 3.0 * (1 - fade) + rng.normal(0, 0.01, cycle_count)
+            temp = rng.normal(27, 1.5, cycle_count)
+            CycleData.objects.bulk_create([
+                CycleData(
+                    battery=battery,
+                    cycle_number=int(number),
+                    discharge_capacity=float(discharge[i]),
+                    charge_capacity=float(discharge[i] * 1.01),
+                    avg_current=float(rng.normal(0, 0.5)),
+                    avg_voltage=float(rng.normal(3.7, 0.05)),
+                    avg_temp=float(temp[i]),
+                    max_temp=float(temp[i] + 3),
+                    min_temp=float(temp[i] - 3),
+                )
+                for i, number in enumerate(cycle_numbers)
+            ], batch_size=5000)
+        self.seed_samples(batteries[0], cycle_count, rng)
+
+    def seed_samples(self, battery, cycle_count, rng):
+        """
+        Stores SAMPLES_PER_CYCLE synthetic raw samples per cycle for
+        `battery` in the sample store.
+        """
+        content_hash = f'{battery.pk:064x}'
+        SourceFile.objects.create(
+            path=battery.file_name, battery=battery, size=0, mtime=0,
+            content_hash=content_hash, parser_version=0)
+        rows = cycle_count * SAMPLES_PER_CYCLE
+        sheet = pd.DataFrame({
+            column: rng.normal(size=rows).astype(np.float32)
+            for column in SAMPLE_CHANNELS.values()
+        })
+        sheet['Cycle_Index'] = np.repeat(
+            np.arange(1, cycle_count + 1), SAMPLES_PER_CYCLE)
+        writer = SampleWriter(settings.SAMPLE_STORE_DIR, content_hash)
+        try:
+            writer.add(sheet)
+            writer.commit()
+        finally:
+            writer.discard()
+
+    def endpoints(self):
+        """
+        Returns {name: url} for every read endpoint, using the first
+        seeded batteries where one is needed. Endpoints whose name starts
+        with `async-` are requested through the ASGI handler.
+        """
+        first = Battery.objects.order_by('pk').first()
+        ids = list(Battery.objects.order_by('pk').values_list('pk', flat=True)[:5])
+        detail = reverse('battery-detail', kwargs={
+            'voltage_type': first.voltage_type,
+            'battery_number': first.battery_number,
+        })
+        battery_list = reverse(
+            'battery-list', kwargs={'voltage_type': first.voltage_type})
+        samples = reverse('battery-samples', kwargs={
+            'voltage_type': first.voltage_type,
+            'battery_number': first.battery_number,
+        })
+        summary = reverse('battery-summary')
+        return {
+            'battery-summary': summary,
+            'battery-summary weighted': summary + '?w_cycles=0.6&w_soh=0.4',
+            'battery-summary top 10': summary + '?ordering=-balanced_score&limit=10',
+            'battery-list': battery_list,
+            'battery-list columnar': battery_list + '?layout=columnar',
+            'battery-list max_points=100': battery_list + '?max_points=100',
+            'battery-detail': detail,
+            'battery-detail limit=50': detail + '?limit=50',
+            'battery-samples': samples + '?cycle=1',
+            'battery-samples 10 cycles': samples + '?cycle_from=1&cycle_to=10',
+            'battery-compare': '{}?batteries={}'.format(
+                reverse('battery-compare'), ','.join(map(str, ids))),
+            'battery-cohorts': reverse('battery-cohorts'),
+            'async-battery-summary': reverse('async-battery-summary'),
+            'async-battery-list': reverse(
+                'async-battery-list', kwargs={'voltage_type': first.voltage_type}),
+            'async-battery-detail': reverse('async-battery-detail', kwargs={
+                'voltage_type': first.voltage_type,
+                'battery_number': first.battery_number,
+            }),
+            'health_check': reverse('health_check'),
+            'metrics': reverse('metrics'),
+        }
+
+    def run_benchmark(self, request_count, warmup):
+        client = Client()
+        async_fetch = async_to_sync(self.fetch_async)
+        async_client = AsyncClient()
+        results = {}
+        for name, url in self.endpoints().items():
+            if name.startswith('async-'):
+                fetch = partial(async_fetch, async_client)
+            else:
+                fetch = partial(self.fetch, client)
+            for _ in range(warmup):
+                fetch(url)
+
+            latencies, queries, sizes, errors = [], [], [], 0
+            for _ in range(request_count):
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    status, size = fetch(url)
+                    latencies.append(time.perf_counter() - start)
+                queries.append(sum(
+                    not query['sql'].upper().startswith(TRANSACTION_STATEMENTS)
+                    for query in captured))
+                sizes.append(size)
+                errors += status >= 400
+
+            latencies = np.array(latencies) * 1000
+            results[name] = {
+                'url': url,
+                'requests': request_count,
+                'errors': errors,
+                **{
+                    f'p{p}_ms': round(float(value), 3) for p, value in zip(
+                        PERCENTILES, np.percentile(latencies, PERCENTILES))
+                },
+                'mean_ms': round(float(latencies.mean()), 3),
+                # Sequential, single-threaded throughput.
+                'requests_per_second': round(float(1000 / latencies.mean()), 1),
+                'queries_per_request': round(float(np.mean(queries)), 2),
+                'response_bytes': int(np.mean(sizes)),
+            }
+        return results
+
+    def fetch(self, client, url):
+        response = client.get(url, HTTP_ACCEPT='application/json')
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        return response.status_code, size
+
+    async def fetch_async(self, client, url):
+        response = await client.get(url, headers={'accept': 'application/json'})
+        if response.streaming:
+            size = sum([len(chunk) async for chunk in response.streaming_content])
+        else:
+            size = len(response.content)
+        return response.status_code, size
+
+    def print_table(self, results):
+        header = (
+            f"{'endpoint':<30}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'req/s':>10}{'queries':>9}{'bytes':>12}")
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<30}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                f"{result['p99_ms']:>10.2f}{result['requests_per_second']:>10.1f}"
+                f"{result['queries_per_request']:>9.2f}{result['response_bytes']:>12}"
+                + (self.style.ERROR(f"  {result['errors']} errors") if result['errors'] else ''))
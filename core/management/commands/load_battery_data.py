@@ -1,11 +1,63 @@
+import argparse
+import cProfile
+import json
+import multiprocessing
 import os
-import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from functools import partial
+
 import pandas as pd
-from django.core.management.base import BaseCommand
-from django.db.models import Avg
 from django.conf import settings
-from django.utils import timezone
-from core.models import Battery, CycleData
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Avg, OuterRef, Subquery
+from core.analytics import FIT_COLUMNS, fit_fade_models
+from core.dataset import (
+    checkpoint_database, dataset_version, next_dataset_version,
+    publish_dataset_version, use_write_ahead_log)
+from core.ingest import (
+    EXCEL_EXTENSIONS, PARSER_VERSION, VOLTAGE_DIRS, parse_file_name,
+    summarize_workbook)
+from core.models import Battery, CycleData, SourceFile
+from core.parse_cache import (
+    DEFAULT_CACHE_DIR, file_digest, prune as prune_parse_cache)
+from core.profiling import LoadProfiler
+from core.sample_store import entry_dir, prune
+from core.snapshots import materialize_snapshots, snapshot_exists
+
+# Aggregated columns written to CycleData on every (re)load.
+CYCLE_FIELDS = [
+    'discharge_capacity',
+    'charge_capacity',
+    'avg_current',
+    'avg_voltage',
+    'avg_temp',
+    'max_temp',
+    'min_temp',
+]
+
+# Pre-calculated Battery columns rewritten by Phase 2.
+SUMMARY_FIELDS = [
+    'state_of_health',
+    'overall_avg_temp',
+    'overall_avg_discharge',
+    'durability_score',
+    'resilience_score',
+    'balanced_score',
+]
+
+
+def positive_int(value):
+    """argparse type for options that must be a positive integer."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            f'must be a positive integer, not {value!r}')
+    return number
 
 
 class Command(BaseCommand):
@@ -15,150 +67,447 @@ class Command(BaseCommand):
     """
     help = 'Loads and processes all battery data from Excel files.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=positive_int,
+            default=500,
+            help='Number of CycleData rows written per bulk upsert statement.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of processes used to parse and aggregate the Excel '
+                 'files. All database writes stay in the main process.',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-parse every file and recompute every battery, even if '
+                 'the manifest says nothing changed.',
+        )
+        parser.add_argument(
+            '--no-parse-cache',
+            action='store_true',
+            help='Decode every Excel file from scratch instead of reading the '
+                 'columnar parse cache (PARSE_CACHE_DIR).',
+        )
+        parser.add_argument(
+            '--no-snapshots',
+            action='store_true',
+            help='Do not pre-render the API payloads into SNAPSHOT_DIR.',
+        )
+        parser.add_argument(
+            '--no-samples',
+            action='store_true',
+            help='Do not keep the raw per-sample series in SAMPLE_STORE_DIR.',
+        )
+        parser.add_argument(
+            '--profile',
+            action='store_true',
+            help='Print wall time, queries and peak memory per load phase '
+                 'and the parse throughput of each file.',
+        )
+        parser.add_argument(
+            '--profile-output',
+            help='Write the profiling report as JSON to this path. Implies '
+                 '--profile.',
+        )
+        parser.add_argument(
+            '--cprofile',
+            help='Run the load under cProfile and dump the stats to this path '
+                 '(for pstats or snakeviz). Implies --profile.',
+        )
+        parser.add_argument(
+            '--tracemalloc',
+            action='store_true',
+            help='With --profile, also report the peak Python allocation of '
+                 'each phase. Slows the load down noticeably.',
+        )
+
     def handle(self, *args, **kwargs):
+        profiler = LoadProfiler(
+            enabled=bool(kwargs['profile'] or kwargs['profile_output']
+                         or kwargs['cprofile']),
+            trace_memory=kwargs['tracemalloc'],
+        )
+        stats = cProfile.Profile() if kwargs['cprofile'] else None
+        try:
+            if stats is not None:
+                stats.enable()
+            self.load(profiler, **kwargs)
+        finally:
+            if stats is not None:
+                stats.disable()
+                stats.dump_stats(kwargs['cprofile'])
+            profiler.stop()
+            if profiler.enabled:
+                self.write_profile(profiler, kwargs['profile_output'])
+
+    def write_profile(self, profiler, output):
+        report = profiler.report()
+        self.stdout.write(self.style.SUCCESS("\n--- Load Profile ---"))
+        for line in profiler.format_table(report):
+            self.stdout.write(line)
+        if output:
+            with open(output, 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f"Profile written to {output}"))
+
+    def load(self, profiler, **kwargs):
+        force = kwargs['force']
+        sample_dir = None if kwargs['no_samples'] else settings.SAMPLE_STORE_DIR
+
         # --- PHASE 1: LOAD RAW CYCLE DATA ---
         self.stdout.write(self.style.SUCCESS(
             "--- Phase 1: Ingesting Cycle Data from Excel Files ---"))
 
-        voltage_dirs = {
-            'normal': os.path.join('data', 'normal_voltage'),
-            'reduced': os.path.join('data', 'reduced_voltage'),
-        }
-
-        for v_type, data_dir in voltage_dirs.items():
-            if not os.path.isdir(data_dir):
-                self.stdout.write(self.style.WARNING(
-                    f"Directory not found, skipping: {data_dir}"))
-                continue
+        # Lets the API keep reading the previous generation while this load
+        # writes the next one.
+        use_write_ahead_log()
 
-            self.stdout.write(f"Processing directory: {data_dir}")
+        files = []
+        with profiler.phase('scan'):
+            manifest = {entry.path: entry for entry in SourceFile.objects.all()}
 
-            for filename in os.listdir(data_dir):
-                if not filename.endswith(('.xls', '.xlsx')):
+            for v_type, data_dir in VOLTAGE_DIRS.items():
+                if not os.path.isdir(data_dir):
+                    self.stdout.write(self.style.WARNING(
+                        f"Directory not found, skipping: {data_dir}"))
                     continue
 
-                parts = filename.split('_')
-                c_rate_val = parts[1] if len(parts) > 1 else None
-                stress_test_val = parts[2] if len(parts) > 2 else None
-                match = re.search(r'B[ab](\d+)_', filename)
-                battery_num = int(match.group(1)) if match else None
+                self.stdout.write(f"Processing directory: {data_dir}")
+
+                for filename in os.listdir(data_dir):
+                    if not filename.endswith(EXCEL_EXTENSIONS):
+                        continue
+                    file_path = os.path.join(data_dir, filename)
+                    stamp = self.stamp_file(
+                        file_path, manifest.get(file_path), force, sample_dir)
+                    if stamp is not None:
+                        files.append((v_type, filename, file_path, stamp))
+
+        self.stdout.write(
+            f"{len(files)} new or changed file(s) to ingest.")
+
+        # Every file is parsed before the transaction opens, so the database
+        # is only locked for the writes. The summaries are per-cycle
+        # aggregates, small enough to hold together.
+        summaries = self.summarize_files(
+            [(file_path, stamp['content_hash'])
+             for _, _, file_path, stamp in files],
+            kwargs['workers'],
+            None if kwargs['no_parse_cache'] else DEFAULT_CACHE_DIR,
+            sample_dir,
+            profiler.trace_memory,
+        )
+        parsed = []
+        # Closing the generator shuts the worker pool down as soon as the
+        # last file is parsed, rather than whenever it is garbage collected.
+        with closing(summaries):
+            for _, _, file_path, _ in files:
+                # With workers this is the wait for the file's result, not
+                # the parse itself; the parse times come from the worker's
+                # profile.
+                with profiler.phase('parse', file_path):
+                    cycle_summary = next(summaries)
+                profiler.add_file_stats(
+                    file_path, cycle_summary.attrs.get('profile', {}))
+                parsed.append(cycle_summary)
+
+        # The new generation is written in a single transaction that publishes
+        # its version as the last write. API readers keep seeing the previous
+        # generation, complete, until the commit switches them over at once.
+        with transaction.atomic():
+            version = self.build_generation(files, parsed, profiler, **kwargs)
+
+        content_hashes = set(
+            SourceFile.objects.values_list('content_hash', flat=True))
+        if sample_dir is not None:
+            # Only now, as readers of the previous generation may still have
+            # needed the entries of replaced files until the commit.
+            with profiler.phase('prune_samples'):
+                prune(sample_dir, content_hashes)
+        if not kwargs['no_parse_cache']:
+            with profiler.phase('prune_parse_cache'):
+                prune_parse_cache(DEFAULT_CACHE_DIR, content_hashes)
 
+        if version is not None:
+            with profiler.phase('checkpoint'):
+                checkpoint_database()
+            self.stdout.write(self.style.SUCCESS(
+                f"Published dataset version {version}"))
+
+    def build_generation(self, files, summaries, profiler, **kwargs):
+        """
+        Writes the parsed `summaries` of `files`, recalculates the statistics
+        and publishes a new dataset version, all in the caller's transaction.
+        Returns the new version, or None if nothing changed.
+        """
+        batch_size = kwargs['batch_size']
+        force = kwargs['force']
+
+        changed_ids = []
+        for (v_type, filename, file_path, stamp), cycle_summary in zip(
+                files, summaries):
+            # A handful of batched statements per file instead of a SELECT
+            # plus an INSERT/UPDATE per cycle.
+            with profiler.phase('write', file_path):
                 battery, created = Battery.objects.update_or_create(
                     file_name=filename,
                     defaults={
-                        'battery_number': battery_num,
+                        **parse_file_name(filename),
                         'voltage_type': v_type,
-                        'c_rate': c_rate_val,
-                        'stress_test': stress_test_val
+                        'cycle_count': len(cycle_summary),
                     }
                 )
+                self.upsert_cycles(battery, cycle_summary, batch_size)
+                SourceFile.objects.update_or_create(
+                    path=file_path,
+                    defaults={**stamp, 'battery': battery},
+                )
+            changed_ids.append(battery.id)
 
-                all_sheets = pd.read_excel(os.path.join(
-                    data_dir, filename), sheet_name=None)
-                df = pd.concat(all_sheets.values(), ignore_index=True)
-
-                df.rename(
-                    columns={'Temperature (C)_1': 'temperature_c'}, inplace=True)
-                df['Cycle_Index'] = pd.to_numeric(
-                    df['Cycle_Index'], errors='coerce')
-                df.dropna(subset=['Cycle_Index'], inplace=True)
-                df['Cycle_Index'] = df['Cycle_Index'].astype(int)
-
-                cycle_summary = df.groupby('Cycle_Index').agg(
-                    discharge_capacity=('Discharge_Capacity(Ah)', 'max'),
-                    charge_capacity=('Charge_Capacity(Ah)', 'max'),
-                    avg_current=('Current(A)', 'mean'),
-                    avg_voltage=('Voltage(V)', 'mean'),
-                    avg_temp=('temperature_c', 'mean'),
-                    max_temp=('temperature_c', 'max'),
-                    min_temp=('temperature_c', 'min')
-                ).reset_index()
-
-                battery.cycle_count = len(cycle_summary)
-                battery.save(update_fields=['cycle_count'])
-
-                for index, row in cycle_summary.iterrows():
-                    CycleData.objects.update_or_create(
-                        battery=battery,
-                        cycle_number=row['Cycle_Index'],
-                        defaults={
-                            'discharge_capacity': row['discharge_capacity'],
-                            'charge_capacity': row['charge_capacity'],
-                            'avg_current': row['avg_current'],
-                            'avg_voltage': row['avg_voltage'],
-                            'avg_temp': row['avg_temp'],
-                            'max_temp': row['max_temp'],
-                            'min_temp': row['min_temp'],
-                        }
-                    )
+        if not changed_ids and not force:
+            self.stdout.write(self.style.SUCCESS(
+                "--- No data files changed, nothing to recalculate. ---"))
+            version = dataset_version()
+            if (version and not kwargs['no_snapshots']
+                    and not snapshot_exists(version)):
+                with profiler.phase('snapshots'):
+                    self.write_snapshots(version)
+            return None
 
         # --- PHASE 2: CALCULATE AND SAVE SUMMARY STATISTICS ---
         self.stdout.write(self.style.SUCCESS(
             "\n--- Phase 2: Calculating and Saving Summary Statistics ---"))
 
-        batteries = Battery.objects.all()
-        summary_data = []
+        # Per-battery statistics only change when the battery's file did,
+        # but the scores are normalized across every battery.
+        recalculated = Battery.objects.all()
+        if not force:
+            recalculated = recalculated.filter(pk__in=changed_ids)
+        with profiler.phase('summary_statistics'):
+            df = self.summary_statistics(recalculated)
+            # A battery whose file no longer has a usable cycle has no
+            # statistics now; its old ones must not stay in the ranking.
+            recalculated.exclude(pk__in=df.index.tolist()).update(
+                **dict.fromkeys(SUMMARY_FIELDS))
+
+        if df.empty:
+            self.stdout.write(self.style.WARNING(
+                "No summary data to process for ranking."))
+        else:
+            self.save_scores(df, batch_size, profiler)
+        with profiler.phase('fade_fits'):
+            self.save_fade_fits(recalculated, batch_size)
+
+        self.stdout.write(self.style.SUCCESS(
+            "--- All calculations complete and saved! ---"))
 
-        for battery in batteries:
-            cycles = battery.cycles.filter(discharge_capacity__gt=0)
-            if not cycles.exists():
-                continue
+        # Pre-render the API payloads before publishing the new version, so
+        # the first requests for it can already be served from snapshots.
+        version = next_dataset_version()
+        if not kwargs['no_snapshots']:
+            with profiler.phase('snapshots'):
+                self.write_snapshots(version)
 
-            first_cycle = cycles.earliest('cycle_number')
-            last_cycle = cycles.latest('cycle_number')
-            soh = round((last_cycle.discharge_capacity / first_cycle.discharge_capacity)
-                        * 100, 2) if first_cycle.discharge_capacity > 0 else 0
+        return publish_dataset_version(version)
 
-            aggregates = battery.cycles.all().aggregate(avg_temp=Avg(
-                'avg_temp'), avg_discharge=Avg('discharge_capacity'))
+    def save_scores(self, df, batch_size, profiler):
+        """
+        Normalizes the ranking inputs in `df` across its batteries and saves
+        the statistics and scores of every one of them.
+        """
+        with profiler.phase('scores'):
+            soh_range = df['state_of_health'].max() - df['state_of_health'].min()
+            cycles_range = df['cycle_count'].max() - df['cycle_count'].min()
 
-            summary_data.append({
-                'id': battery.id,
-                'cycle_count': battery.cycle_count or 0,
-                'state_of_health': soh,
-                'overall_avg_temp': aggregates.get('avg_temp') or 0,
-                'overall_avg_discharge': aggregates.get('avg_discharge') or 0,
-            })
+            df['norm_soh'] = (df['state_of_health'] - df['state_of_health'].min()
+                              ) / soh_range if soh_range > 0 else 0.5
+            df['norm_cycles'] = (df['cycle_count'] - df['cycle_count'].min()
+                                 ) / cycles_range if cycles_range > 0 else 0.5
 
-        if not summary_data:
-            self.stdout.write(self.style.WARNING(
-                "No summary data to process for ranking."))
-            return
+            df['durability_score'] = (
+                df['norm_cycles'] * 0.7 + df['norm_soh'] * 0.3).round(4)
+            df['resilience_score'] = (
+                df['norm_cycles'] * 0.3 + df['norm_soh'] * 0.7).round(4)
+            df['balanced_score'] = (
+                df['norm_cycles'] * 0.5 + df['norm_soh'] * 0.5).round(4)
 
-        df = pd.DataFrame(summary_data).set_index('id')
-
-        soh_range = df['state_of_health'].max() - df['state_of_health'].min()
-        cycles_range = df['cycle_count'].max() - df['cycle_count'].min()
-
-        df['norm_soh'] = (df['state_of_health'] - df['state_of_health'].min()
-                          ) / soh_range if soh_range > 0 else 0.5
-        df['norm_cycles'] = (df['cycle_count'] - df['cycle_count'].min()
-                             ) / cycles_range if cycles_range > 0 else 0.5
-
-        df['durability_score'] = (
-            df['norm_cycles'] * 0.7 + df['norm_soh'] * 0.3).round(4)
-        df['resilience_score'] = (
-            df['norm_cycles'] * 0.3 + df['norm_soh'] * 0.7).round(4)
-        df['balanced_score'] = (
-            df['norm_cycles'] * 0.5 + df['norm_soh'] * 0.5).round(4)
-
-        for battery_id, row in df.iterrows():
-            Battery.objects.filter(pk=battery_id).update(
-                state_of_health=row['state_of_health'],
-                overall_avg_temp=round(row['overall_avg_temp'], 2),
-                overall_avg_discharge=round(row['overall_avg_discharge'], 2),
-                durability_score=row['durability_score'],
-                resilience_score=row['resilience_score'],
-                balanced_score=row['balanced_score']
+            Battery.objects.bulk_update(
+                [
+                    Battery(pk=battery_id, **{
+                        field: row[field] for field in SUMMARY_FIELDS})
+                    for battery_id, row in df.iterrows()
+                ],
+                SUMMARY_FIELDS,
+                batch_size=batch_size,
             )
 
+    def write_snapshots(self, version):
+        count = materialize_snapshots(version)
         self.stdout.write(self.style.SUCCESS(
-            "--- All calculations complete and saved! ---"))
+            f"Materialized {count} API snapshot(s) for version {version}"))
 
-        # --- ADD THIS BLOCK TO SAVE THE TIMESTAMP ---
-        timestamp_file_path = os.path.join(
-            settings.BASE_DIR, 'last_update.txt')
-        with open(timestamp_file_path, 'w') as f:
-            f.write(timezone.now().isoformat())
-        self.stdout.write(self.style.SUCCESS(
-            f'Successfully updated timestamp file at {timestamp_file_path}'))
+    def summary_statistics(self, recalculated):
+        """
+        Returns the ranking inputs of every battery with usable cycles,
+        indexed by id. Batteries in `recalculated` get fresh statistics from
+        a single grouped query, and are left out if they have no usable
+        cycle left; all others keep their stored values.
+        """
+        usable = CycleData.objects.filter(
+            battery=OuterRef('pk'), discharge_capacity__gt=0
+        ).order_by('cycle_number').values('discharge_capacity')
+
+        fresh = pd.DataFrame.from_records(
+            recalculated.annotate(
+                first_capacity=Subquery(usable[:1]),
+                last_capacity=Subquery(usable.reverse()[:1]),
+                avg_temp=Avg('cycles__avg_temp'),
+                avg_discharge=Avg('cycles__discharge_capacity'),
+            ).values_list(
+                'id', 'cycle_count', 'first_capacity', 'last_capacity',
+                'avg_temp', 'avg_discharge'),
+            columns=['id', 'cycle_count', 'first_capacity', 'last_capacity',
+                     'avg_temp', 'avg_discharge'],
+            index='id',
+        ).dropna(subset=['first_capacity'])
+
+        fresh['state_of_health'] = (
+            fresh['last_capacity'] / fresh['first_capacity'] * 100
+        ).apply(round, args=(2,))
+        fresh['overall_avg_temp'] = fresh['avg_temp'].fillna(0).apply(
+            round, args=(2,))
+        fresh['overall_avg_discharge'] = fresh['avg_discharge'].fillna(
+            0).apply(round, args=(2,))
+
+        columns = ['cycle_count', 'state_of_health',
+                   'overall_avg_temp', 'overall_avg_discharge']
+        stored = pd.DataFrame.from_records(
+            Battery.objects.filter(state_of_health__isnull=False)
+            .exclude(pk__in=recalculated)
+            .values_list('id', *columns),
+            columns=['id', *columns],
+            index='id',
+        )
+
+        df = pd.concat(
+            [frame for frame in (fresh[columns], stored) if len(frame)]
+            or [fresh[columns]])
+        df['cycle_count'] = df['cycle_count'].fillna(0)
+        return df
+
+    def save_fade_fits(self, batteries, batch_size):
+        """
+        Fits the capacity-fade models to the usable cycles of all `batteries`
+        in one batch and saves the best fit of each.
+        """
+        cycles = pd.DataFrame.from_records(
+            CycleData.objects.filter(
+                battery__in=batteries, discharge_capacity__gt=0
+            ).order_by('battery_id', 'cycle_number').values_list(
+                'battery_id', 'cycle_number', 'discharge_capacity'),
+            columns=['battery_id', 'cycle_number', 'discharge_capacity'],
+        )
+        fits = fit_fade_models(
+            cycles['battery_id'].to_numpy(),
+            cycles['cycle_number'].to_numpy(),
+            cycles['discharge_capacity'].to_numpy(),
+        )
+
+        no_fit = dict.fromkeys(FIT_COLUMNS)
+        Battery.objects.bulk_update(
+            [
+                Battery(pk=battery_id, **(
+                    fits.loc[battery_id].to_dict()
+                    if battery_id in fits.index else no_fit))
+                for battery_id in batteries.values_list('id', flat=True)
+            ],
+            FIT_COLUMNS,
+            batch_size=batch_size,
+        )
+
+    def stamp_file(self, file_path, entry, force, sample_dir=None):
+        """
+        Returns the manifest fields for a file that needs to be ingested, or
+        None if its manifest entry shows it is unchanged. The content hash is
+        only computed when the cheap size/mtime check is inconclusive.
+
+        With `sample_dir`, a file whose raw samples are missing from the
+        sample store is ingested again so they get written.
+        """
+        stat = os.stat(file_path)
+        stamp = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'parser_version': PARSER_VERSION,
+        }
+        if entry is not None and sample_dir is not None and not os.path.isdir(
+                entry_dir(sample_dir, entry.content_hash)):
+            entry = None
+        if (not force and entry is not None
+                and entry.parser_version == PARSER_VERSION
+                and entry.size == stamp['size']
+                and entry.mtime == stamp['mtime']):
+            return None
+
+        stamp['content_hash'] = file_digest(file_path)
+        if (not force and entry is not None
+                and entry.parser_version == PARSER_VERSION
+                and entry.content_hash == stamp['content_hash']):
+            # Touched but identical; remember the new mtime and move on.
+            SourceFile.objects.filter(pk=entry.pk).update(mtime=stamp['mtime'])
+            return None
+        return stamp
+
+    def summarize_files(self, files, workers, cache_dir, sample_dir=None,
+                        trace_memory=False):
+        """
+        Yields the per-cycle summary of each (path, content hash) pair, in
+        order. With more than one worker the files are parsed in a process
+        pool while the caller writes the summaries that are already done.
+        """
+        summarize = partial(
+            summarize_workbook, cache_dir=cache_dir, sample_dir=sample_dir,
+            trace_memory=trace_memory)
+        file_paths = [file_path for file_path, _ in files]
+        content_hashes = [content_hash for _, content_hash in files]
+
+        if workers <= 1 or len(files) <= 1:
+            yield from map(summarize, file_paths, content_hashes)
+            return
+
+        # Workers start from a fork server, so they never inherit the open
+        # database connection.
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('forkserver')) as executor:
+            yield from executor.map(summarize, file_paths, content_hashes)
+
+    def upsert_cycles(self, battery, cycle_summary, batch_size):
+        """
+        Inserts or updates the aggregated cycles of one battery using batched
+        INSERT ... ON CONFLICT statements on the (battery, cycle_number) key,
+        and deletes the cycles the file no longer contains.
+        """
+        CycleData.objects.filter(battery=battery).exclude(
+            cycle_number__in=cycle_summary['Cycle_Index'].tolist()).delete()
+        cycles = [
+            CycleData(
+                battery=battery,
+                cycle_number=row['Cycle_Index'],
+                **{field: row[field] for field in CYCLE_FIELDS}
+            )
+            for row in cycle_summary.to_dict('records')
+        ]
+        CycleData.objects.bulk_create(
+            cycles,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['battery', 'cycle_number'],
+            update_fields=CYCLE_FIELDS,
+        )
@@ -0,0 +1,208 @@
+"""
+In-memory serving mode for the battery endpoints.
+
+With `IN_MEMORY_DATASET` enabled, each process loads the whole dataset once
+per dataset version: the summary rows as ready-to-render dicts, and every
+cycle in one (cycle x field) float array sorted by battery and cycle, so
+each battery's cycles are a contiguous slice. The list, detail and summary
+views then answer from these structures without touching the database.
+
+A new version is loaded into a fresh `Dataset` and swapped in with a
+single assignment, so a request always sees one complete version. With
+gunicorn `--preload`, `preload()` runs in the master process and the arrays
+are shared copy-on-write by the workers.
+"""
+import threading
+
+import numpy as np
+from django.db import DatabaseError, connections
+from django.http import Http404
+
+from .dataset import consistent_read, dataset_version
+from .models import Battery, CycleData
+from .serializers import (
+    BatterySummarySerializer, page_battery, with_cycles)
+from .series import SERIES_FIELDS, downsample
+
+# Downsampled series memoized per Dataset before the memo is reset.
+MAX_DOWNSAMPLED = 4096
+
+_lock = threading.Lock()
+_dataset = None
+
+
+class Dataset:
+    """
+    One dataset version held in memory.
+    """
+
+    def __init__(self, version):
+        self.version = version
+
+        # Summary rows in the summary endpoint's order, which also orders
+        # each voltage type's batteries by number like the list endpoint.
+        self.summaries = [
+            dict(summary) for summary in BatterySummarySerializer(
+                Battery.objects.order_by('voltage_type', 'battery_number'),
+                many=True).data
+        ]
+        self.by_id = {summary['id']: summary for summary in self.summaries}
+        self.by_number = {
+            (summary['voltage_type'], summary['battery_number']): summary
+            for summary in self.summaries
+        }
+
+        rows = np.array(
+            list(CycleData.objects.order_by('battery_id', 'cycle_number')
+                 .values_list('battery_id', *SERIES_FIELDS)),
+            dtype=float,
+        ).reshape(-1, len(SERIES_FIELDS) + 1)
+        self.cycle_numbers = rows[:, 1].astype(np.int64)
+        self.values = np.ascontiguousarray(rows[:, 2:])
+        self.missing = np.isnan(self.values).any(axis=1)
+
+        ids, starts, counts = np.unique(
+            rows[:, 0].astype(np.int64), return_index=True, return_counts=True)
+        self.slices = {
+            battery_id: slice(start, start + count)
+            for battery_id, start, count in zip(
+                ids.tolist(), starts.tolist(), counts.tolist())
+        }
+        self._downsampled = {}
+
+    def battery_row(self, summary):
+        return (summary['id'], summary['file_name'], summary['cycle_count'])
+
+    def get(self, voltage_type, battery_number):
+        summary = self.by_number.get((voltage_type, battery_number))
+        if summary is None:
+            raise Http404('No Battery matches the given query.')
+        return summary
+
+    def batteries(self, voltage_type):
+        return [
+            summary for summary in self.summaries
+            if summary['voltage_type'] == voltage_type
+        ]
+
+    def cycle_values(self, battery_id, cycle_filters=None, limit=None):
+        """
+        Returns a battery's cycles as value tuples, like `cycle_values`.
+        `cycle_filters` takes the same cycle_number lookups as
+        `serialize_battery` and is applied with binary search.
+        """
+        window = self.slices.get(battery_id, slice(0, 0))
+        numbers = self.cycle_numbers[window]
+        start, stop = 0, len(numbers)
+        for lookup, value in (cycle_filters or {}).items():
+            if lookup == 'cycle_number__lte':
+                stop = min(stop, np.searchsorted(numbers, value, 'right'))
+            else:
+                side = 'left' if lookup == 'cycle_number__gte' else 'right'
+                start = max(start, np.searchsorted(numbers, value, side))
+        start, stop = window.start + int(start), window.start + int(stop)
+        if limit is not None:
+            stop = min(stop, start + limit)
+        if start >= stop:
+            return []
+
+        values = self.values[start:stop].tolist()
+        if self.missing[start:stop].any():
+            values = [
+                [None if value != value else value for value in row]
+                for row in values
+            ]
+        return [
+            (number, *row)
+            for number, row in zip(self.cycle_numbers[start:stop].tolist(), values)
+        ]
+
+    def downsampled_values(self, battery_id, max_points):
+        key = (battery_id, max_points)
+        if key not in self._downsampled:
+            if len(self._downsampled) >= MAX_DOWNSAMPLED:
+                self._downsampled.clear()
+            self._downsampled[key] = downsample(
+                self.cycle_values(battery_id), max_points)
+        return self._downsampled[key]
+
+    def serialize_batteries(self, voltage_type, columnar=False, max_points=None):
+        """
+        In-memory counterpart of `serialize_batteries` for one voltage type.
+        """
+        rows = [self.battery_row(summary) for summary in self.batteries(voltage_type)]
+        if max_points:
+            values = {row[0]: self.downsampled_values(row[0], max_points) for row in rows}
+        else:
+            values = {row[0]: self.cycle_values(row[0]) for row in rows}
+        return with_cycles(rows, values, columnar)
+
+    def serialize_battery(self, summary, columnar=False, max_points=None,
+                          cycle_filters=None, limit=None):
+        """
+        In-memory counterpart of `serialize_battery`.
+        """
+        row = self.battery_row(summary)
+        if max_points and not cycle_filters and limit is None:
+            return with_cycles(
+                [row], {row[0]: self.downsampled_values(row[0], max_points)},
+                columnar)[0]
+        series = self.cycle_values(
+            row[0], cycle_filters, None if limit is None else limit + 1)
+        return page_battery(row, series, columnar, max_points, limit)
+
+    def export_batteries(self, voltage_type, max_points=None):
+        """
+        In-memory counterpart of `export_batteries`.
+        """
+        return [
+            {'metadata': self.by_id[battery['id']], 'cycles': battery['cycles']}
+            for battery in self.serialize_batteries(
+                voltage_type, columnar=True, max_points=max_points)
+        ]
+
+    def export_battery(self, summary, **options):
+        """
+        In-memory counterpart of `export_battery`.
+        """
+        data = self.serialize_battery(summary, columnar=True, **options)
+        metadata = dict(summary)
+        if 'next_cursor' in data:
+            metadata['next_cursor'] = data['next_cursor']
+        return [{'metadata': metadata, 'cycles': data['cycles']}]
+
+
+def current():
+    """
+    Returns the Dataset of the current dataset version, loading it first if
+    this process holds none or an older one. Before the first version is
+    published there is nothing to tell the data has changed, so a fresh
+    Dataset is loaded on every call.
+    """
+    global _dataset
+    version = dataset_version()
+    if version is None:
+        return Dataset(version)
+    dataset = _dataset
+    if dataset is None or dataset.version != version:
+        with _lock:
+            if _dataset is None or _dataset.version != version:
+                _dataset = Dataset(version)
+            dataset = _dataset
+    return dataset
+
+
+def preload():
+    """
+    Loads the dataset ahead of the first request, then closes the database
+    connections so forked workers do not share them. Does nothing if the
+    database is not ready yet; the dataset is then loaded on first use.
+    """
+    try:
+        # The version and the rows are read from the same generation.
+        with consistent_read():
+            current()
+    except DatabaseError:
+        pass
+    finally:
+        connections.close_all()
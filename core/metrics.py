@@ -0,0 +1,280 @@
+"""
+Per-endpoint request metrics, exposed at /api/metrics/ in the Prometheus
+text format.
+
+`MetricsMiddleware` measures every request and files it under the URL name
+of its route (`battery-list`, `battery-summary`, ...): latency, database
+queries and their time, the time spent rendering the response body, the
+response size and whether the response cache answered. The work done for a
+request is collected in a `RequestMetrics` held in a context variable, so
+the database wrapper and `render` can add to it from anywhere in the
+request, including the threads async views run their queries in.
+
+The figures are aggregated per process under a lock. With several worker
+processes, each one reports its own.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+# Upper bounds of the histogram buckets, in seconds and bytes.
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (
+    1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+# Endpoint label of requests that matched no route.
+UNRESOLVED = 'unresolved'
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    What one request spent its time on.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serialize_seconds = None
+
+    def add_serialization(self, seconds):
+        self.serialize_seconds = (self.serialize_seconds or 0.0) + seconds
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        # {labels: [count per bucket..., count above the last bucket]}
+        self.counts = defaultdict(lambda: [0] * (len(buckets) + 1))
+        self.sums = defaultdict(float)
+
+    def observe(self, labels, value):
+        self.counts[labels][bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def exposition(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                yield (f'{self.name}_bucket'
+                       f'{_labels(labels, le=_number(bound))} {cumulative}')
+            yield f'{self.name}_sum{_labels(labels)} {_number(self.sums[labels])}'
+            yield f'{self.name}_count{_labels(labels)} {cumulative}'
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = defaultdict(float)
+
+    def inc(self, labels, amount=1):
+        self.values[labels] += amount
+
+    def exposition(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(self.values.items()):
+            yield f'{self.name}{_labels(labels)} {_number(value)}'
+
+
+class Registry:
+    """
+    The metrics of this process. Labels are tuples of (name, value) pairs.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter(
+            'battery_api_requests_total',
+            'Requests handled, by endpoint, method and status code.')
+        self.latency = Histogram(
+            'battery_api_request_duration_seconds',
+            'Time from the request entering the middleware to the response '
+            'leaving it.', LATENCY_BUCKETS)
+        self.queries = Counter(
+            'battery_api_db_queries_total',
+            'Database queries run while handling requests.')
+        self.query_time = Histogram(
+            'battery_api_db_duration_seconds',
+            'Database time per request.', LATENCY_BUCKETS)
+        self.serialization = Histogram(
+            'battery_api_serialization_duration_seconds',
+            'Time spent rendering response bodies, for responses that were '
+            'rendered.', LATENCY_BUCKETS)
+        self.size = Histogram(
+            'battery_api_response_size_bytes',
+            'Response body size, for responses that are not streamed.',
+            SIZE_BUCKETS)
+        self.cache = Counter(
+            'battery_api_cache_requests_total',
+            'Requests to response-cached endpoints, by whether the cache, a '
+            'snapshot or a 304 answered (hit) or the view ran (miss).')
+
+    def record(self, endpoint, method, response, seconds, request_metrics):
+        labels = (('endpoint', endpoint),)
+        with self.lock:
+            self.requests.inc((*labels, ('method', method),
+                               ('status', str(response.status_code))))
+            self.latency.observe(labels, seconds)
+            self.queries.inc(labels, request_metrics.queries)
+            self.query_time.observe(labels, request_metrics.query_seconds)
+            if request_metrics.serialize_seconds is not None:
+                self.serialization.observe(
+                    labels, request_metrics.serialize_seconds)
+            if not response.streaming:
+                self.size.observe(labels, len(response.content))
+            cache_result = getattr(response, 'cache_result', None)
+            if cache_result is not None:
+                self.cache.inc((*labels, ('result', cache_result)))
+
+    def exposition(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        with self.lock:
+            lines = [
+                line
+                for metric in (self.requests, self.latency, self.queries,
+                               self.query_time, self.serialization,
+                               self.size, self.cache)
+                for line in metric.exposition()
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def _labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in pairs) + '}'
+
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """
+    `connection_created` receiver that adds the query timer to a database
+    connection, once per connection object.
+    """
+    if time_query not in connection.execute_wrappers:
+        # Outermost, so it is not popped by an `execute_wrapper()` block
+        # that happens to be open while the connection is made.
+        connection.execute_wrappers.insert(0, time_query)
+
+
+def time_query(execute, sql, params, many, context):
+    request_metrics = _current.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.queries += 1
+        request_metrics.query_seconds += time.perf_counter() - started
+
+
+@contextmanager
+def serializing():
+    """
+    Counts the time spent in the block as serialization of the current
+    request.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_metrics = _current.get()
+        if request_metrics is not None:
+            request_metrics.add_serialization(time.perf_counter() - started)
+
+
+def render(response):
+    """
+    Renders a template response (such as a DRF Response) and counts the
+    time as serialization. Does nothing for rendered responses.
+    """
+    if not response.is_rendered:
+        with serializing():
+            response.render()
+    return response
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, time.perf_counter() - started,
+                    request_metrics)
+        return response
+
+    async def __acall__(self, request):
+        request_metrics = RequestMetrics()
+        token = _current.set(request_metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, time.perf_counter() - started,
+                    request_metrics)
+        return response
+
+    def process_template_response(self, request, response):
+        # The handler renders the response right after this hook, so the
+        # time until the post-render callback is the rendering time.
+        if not response.is_rendered:
+            request_metrics = _current.get()
+            started = time.perf_counter()
+
+            def rendered(response):
+                request_metrics.add_serialization(
+                    time.perf_counter() - started)
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def record(self, request, response, seconds, request_metrics):
+        match = request.resolver_match
+        endpoint = match.url_name if match and match.url_name else UNRESOLVED
+        registry.record(
+            endpoint, request.method, response, seconds, request_metrics)
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_battery_balanced_score_battery_durability_score_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SourceFile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("path", models.CharField(max_length=255, unique=True)),
+                ("size", models.BigIntegerField()),
+                ("mtime", models.FloatField()),
+                ("content_hash", models.CharField(max_length=64)),
+                ("parser_version", models.IntegerField()),
+                ("loaded_at", models.DateTimeField(auto_now=True)),
+                (
+                    "battery",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="source_file",
+                        to="core.battery",
+                    ),
+                ),
+            ],
+        ),
+    ]
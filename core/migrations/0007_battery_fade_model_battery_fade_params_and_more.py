@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_sourcefile"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="battery",
+            name="fade_model",
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name="battery",
+            name="fade_params",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="battery",
+            name="fade_r2",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="battery",
+            name="predicted_eol_cycle",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_battery_fade_model_battery_fade_params_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="battery",
+            index=models.Index(fields=["c_rate"], name="battery_c_rate_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="battery",
+            index=models.Index(fields=["stress_test"], name="battery_stress_test_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="battery",
+            index=models.Index(
+                fields=["state_of_health", "id"], name="battery_soh_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="battery",
+            index=models.Index(
+                fields=["durability_score", "id"], name="battery_durability_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="battery",
+            index=models.Index(
+                fields=["resilience_score", "id"], name="battery_resilience_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="battery",
+            index=models.Index(
+                fields=["balanced_score", "id"], name="battery_balanced_idx"
+            ),
+        ),
+    ]
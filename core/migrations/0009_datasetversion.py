@@ -0,0 +1,52 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:33
+
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def import_last_update(apps, schema_editor):
+    """
+    Publishes the version recorded in last_update.txt, where earlier loads
+    stamped it, so an existing database keeps its version. Databases without
+    batteries, such as fresh and test databases, are left unversioned.
+    """
+    Battery = apps.get_model("core", "Battery")
+    if not Battery.objects.exists():
+        return
+    try:
+        with open(os.path.join(settings.BASE_DIR, "last_update.txt")) as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return
+    if version:
+        DatasetVersion = apps.get_model("core", "DatasetVersion")
+        DatasetVersion.objects.get_or_create(version=version)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_battery_battery_c_rate_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DatasetVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.CharField(max_length=40, unique=True)),
+                ("published_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(import_last_update, migrations.RunPython.noop),
+    ]
@@ -26,8 +26,28 @@ class Battery(models.Model):
     resilience_score = models.FloatField(null=True, blank=True)
     balanced_score = models.FloatField(null=True, blank=True)
 
+    # best capacity-fade fit, see core/analytics.py
+    fade_model = models.CharField(max_length=20, null=True, blank=True)
+    fade_params = models.JSONField(null=True, blank=True)
+    fade_r2 = models.FloatField(null=True, blank=True)
+    predicted_eol_cycle = models.IntegerField(null=True, blank=True)
+
     class Meta:
         unique_together = ('voltage_type', 'battery_number')
+        # For the summary filters and rankings. voltage_type is already
+        # covered by the unique index above. The score indexes end in id,
+        # the tie-breaker, so a ranked top-N is a plain index scan.
+        indexes = [
+            models.Index(fields=['c_rate'], name='battery_c_rate_idx'),
+            models.Index(fields=['stress_test'], name='battery_stress_test_idx'),
+            models.Index(fields=['state_of_health', 'id'], name='battery_soh_idx'),
+            models.Index(
+                fields=['durability_score', 'id'], name='battery_durability_idx'),
+            models.Index(
+                fields=['resilience_score', 'id'], name='battery_resilience_idx'),
+            models.Index(
+                fields=['balanced_score', 'id'], name='battery_balanced_idx'),
+        ]
 
     def __str__(self):
         return self.file_name
@@ -53,3 +73,37 @@ class CycleData(models.Model):
 
     def __str__(self):
         return f"{self.battery.file_name} - Cycle {self.cycle_number}"
+
+
+class DatasetVersion(models.Model):
+    """
+    A published generation of the dataset. `load_battery_data` writes a
+    generation in one transaction and inserts its row last, so readers move
+    from one complete generation to the next when that transaction commits.
+    The newest row is the current version.
+    """
+    # e.g., '2025-07-12T02:05:22.729739+00:00'
+    version = models.CharField(max_length=40, unique=True)
+    published_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.version
+
+
+class SourceFile(models.Model):
+    """
+    Manifest entry for an ingested Excel file. `load_battery_data` compares
+    these fields against the file on disk to skip files that have not changed.
+    """
+    # e.g., 'data/normal_voltage/Ba01_N20_OV1_300, 20% CF, 300 Cycles.xls'
+    path = models.CharField(max_length=255, unique=True)
+    battery = models.OneToOneField(
+        Battery, on_delete=models.CASCADE, related_name='source_file')
+    size = models.BigIntegerField()
+    mtime = models.FloatField()
+    content_hash = models.CharField(max_length=64)
+    parser_version = models.IntegerField()
+    loaded_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.path
@@ -0,0 +1,188 @@
+"""
+On-disk cache of decoded Excel workbooks.
+
+Decoding the legacy `.xls` files through xlrd is far slower than anything we
+do with the data afterwards, so every sheet of a workbook is stored once as
+one `.npy` file per column, keyed by the workbook's content hash. Numeric
+columns are memory-mapped on read.
+
+Sheets are decoded, cached and handed to the caller one at a time, so peak
+memory stays around the size of the largest sheet rather than the whole
+workbook.
+
+This module does not depend on Django so `test_load.py` can use it directly.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Bump when the on-disk layout changes; old entries are then ignored.
+CACHE_FORMAT_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'PARSE_CACHE_DIR',
+    os.path.join(Path(__file__).resolve().parent.parent, '.parse_cache'),
+)
+
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_excel_sheets(file_path):
+    """
+    Yields (sheet name, DataFrame) pairs straight from the Excel file,
+    loading a single sheet at a time.
+    """
+    book = None
+    if str(file_path).endswith('.xls'):
+        import xlrd
+
+        # on_demand keeps xlrd from materializing every sheet up front.
+        book = xlrd.open_workbook(file_path, on_demand=True)
+        excel = pd.ExcelFile(book, engine='xlrd')
+    else:
+        excel = pd.ExcelFile(file_path)
+
+    with excel:
+        for sheet_name in excel.sheet_names:
+            yield sheet_name, excel.parse(sheet_name)
+            if book is not None:
+                book.unload_sheet(sheet_name)
+
+
+def iter_sheets(file_path, content_hash=None, cache_dir=DEFAULT_CACHE_DIR,
+                columns=None):
+    """
+    Yields every sheet of a workbook as a DataFrame, one at a time, decoding
+    the Excel file only if it is not in the cache yet. When `columns` is
+    given, each sheet only carries those of the columns it actually has.
+    Pass `content_hash` when it is already known to avoid hashing the file
+    again, or `cache_dir=None` to bypass the cache.
+    """
+    if cache_dir is None:
+        for _, sheet in iter_excel_sheets(file_path):
+            yield _select(sheet, columns)
+        return
+
+    if content_hash is None:
+        content_hash = file_digest(file_path)
+    entry_dir = os.path.join(cache_dir, _entry_name(content_hash))
+
+    try:
+        with open(os.path.join(entry_dir, 'sheets.json')) as f:
+            sheets = json.load(f)
+    except FileNotFoundError:
+        sheets = None
+
+    if sheets is not None:
+        for sheet in sheets:
+            yield _load_sheet(entry_dir, sheet, columns)
+        return
+
+    writer = _EntryWriter(entry_dir)
+    try:
+        for sheet_name, sheet in iter_excel_sheets(file_path):
+            writer.add(sheet_name, sheet)
+            yield _select(sheet, columns)
+        writer.commit()
+    finally:
+        writer.discard()
+
+
+def read_workbook(file_path, content_hash=None, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Returns the concatenated sheets of a workbook as a single DataFrame.
+    """
+    return pd.concat(
+        iter_sheets(file_path, content_hash, cache_dir), ignore_index=True)
+
+
+def prune(cache_dir, keep_hashes):
+    """
+    Deletes the entries of workbooks whose content hash is not in
+    `keep_hashes`, entries in an older format, and scratch directories left
+    by interrupted writes.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    keep = {_entry_name(content_hash) for content_hash in keep_hashes}
+    for name in os.listdir(cache_dir):
+        if name not in keep:
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+
+def _entry_name(content_hash):
+    return f'{content_hash}.v{CACHE_FORMAT_VERSION}'
+
+
+def _select(sheet, columns):
+    if columns is None:
+        return sheet
+    return sheet[[name for name in sheet.columns if name in columns]]
+
+
+def _load_sheet(entry_dir, sheet, columns):
+    data = {}
+    for column in sheet['columns']:
+        if columns is not None and column['name'] not in columns:
+            continue
+        path = os.path.join(entry_dir, column['file'])
+        if column['pickled']:
+            data[column['name']] = np.load(path, allow_pickle=True)
+        else:
+            data[column['name']] = np.load(path, mmap_mode='r')
+    return pd.DataFrame(data, index=pd.RangeIndex(sheet['rows']))
+
+
+class _EntryWriter:
+    """
+    Writes sheets into a scratch directory and renames it into place on
+    commit, so concurrent readers and writers never see a partial entry.
+    """
+
+    def __init__(self, entry_dir):
+        self.entry_dir = entry_dir
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        self.scratch_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir))
+        self.sheets = []
+
+    def add(self, sheet_name, sheet):
+        index = len(self.sheets)
+        columns = []
+        for i, name in enumerate(sheet.columns):
+            values = sheet[name].to_numpy()
+            pickled = values.dtype.hasobject
+            file_name = f's{index:03d}_c{i:03d}.npy'
+            np.save(os.path.join(self.scratch_dir, file_name), values,
+                    allow_pickle=pickled)
+            columns.append(
+                {'name': name, 'file': file_name, 'pickled': pickled})
+        self.sheets.append(
+            {'name': sheet_name, 'rows': len(sheet), 'columns': columns})
+
+    def commit(self):
+        with open(os.path.join(self.scratch_dir, 'sheets.json'), 'w') as f:
+            json.dump(self.sheets, f)
+        try:
+            os.rename(self.scratch_dir, self.entry_dir)
+        except OSError:
+            # Another process stored the same workbook first.
+            if not os.path.isdir(self.entry_dir):
+                raise
+
+    def discard(self):
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
@@ -0,0 +1,163 @@
+"""
+Instrumentation for `load_battery_data --profile`.
+
+A `LoadProfiler` records wall time, database queries and memory per load
+phase and per file. The operating system only reports the peak resident
+set size over the process lifetime, so each phase records that peak as of
+its end and how much the phase raised it. Files parsed in worker processes
+report the peak of their worker themselves. When profiling is off, `phase`
+does nothing, so the loader can stay instrumented at no cost.
+"""
+import resource
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+from django.db import connection
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class LoadProfiler:
+    def __init__(self, enabled=False, trace_memory=False):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.phases = defaultdict(lambda: defaultdict(int))
+        self.files = defaultdict(lambda: defaultdict(int))
+        self.started = time.perf_counter()
+        if self.trace_memory:
+            tracemalloc.start()
+
+    def phase(self, name, file_path=None):
+        """
+        Context manager that times a phase and counts its queries. With a
+        `file_path`, the figures are also added to that file's record, under
+        the phase name.
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._measure(name, file_path)
+
+    @contextmanager
+    def _measure(self, name, file_path):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        rss_before = peak_rss_mb()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(count):
+                yield
+        finally:
+            seconds = time.perf_counter() - started
+            record = self.phases[name]
+            record['seconds'] += seconds
+            record['queries'] += queries
+            record['calls'] += 1
+            record['peak_rss_mb'] = peak_rss_mb()
+            record['rss_growth_mb'] = round(
+                record['rss_growth_mb'] + record['peak_rss_mb'] - rss_before, 1)
+            if self.trace_memory:
+                record['tracemalloc_peak_mb'] = max(
+                    record['tracemalloc_peak_mb'],
+                    round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1))
+            if file_path is not None:
+                self.files[file_path][f'{name}_seconds'] += seconds
+                self.files[file_path][f'{name}_queries'] += queries
+
+    def add_file_stats(self, file_path, stats):
+        """
+        Merges counters reported for a file, such as the parse profile from
+        `summarize_workbook`. Memory peaks are kept, not added up.
+        """
+        if self.enabled:
+            record = self.files[file_path]
+            for key, value in stats.items():
+                if key.endswith('_mb'):
+                    record[key] = max(record[key], value)
+                else:
+                    record[key] += value
+
+    def report(self):
+        files = {}
+        for file_path, record in self.files.items():
+            record = dict(record)
+            parse_seconds = record.get('read_seconds', 0) + record.get(
+                'aggregate_seconds', 0)
+            if parse_seconds:
+                record['rows_per_second'] = round(
+                    record.get('rows', 0) / parse_seconds)
+            files[file_path] = {
+                key: round(value, 4) if isinstance(value, float) else value
+                for key, value in record.items()
+            }
+        return {
+            'total_seconds': round(time.perf_counter() - self.started, 4),
+            'peak_rss_mb': peak_rss_mb(),
+            # The highest peak of any process that parsed a file.
+            'peak_rss_parse_mb': max(
+                (record.get('peak_rss_mb', 0) for record in files.values()),
+                default=0),
+            'phases': {
+                name: {
+                    key: round(value, 4) if isinstance(value, float) else value
+                    for key, value in record.items()
+                }
+                for name, record in self.phases.items()
+            },
+            'files': files,
+        }
+
+    def format_table(self, report):
+        """
+        Returns the report as lines of text: one row per phase, then one row
+        per file.
+        """
+        lines = [
+            f"{'phase':<22}{'calls':>7}{'seconds':>10}{'queries':>9}"
+            f"{'RSS growth MB':>15}{'peak RSS to date MB':>21}",
+        ]
+        for name, record in report['phases'].items():
+            lines.append(
+                f"{name:<22}{int(record['calls']):>7}{record['seconds']:>10.3f}"
+                f"{int(record['queries']):>9}{record['rss_growth_mb']:>15.1f}"
+                f"{record['peak_rss_mb']:>21.1f}")
+
+        if report['files']:
+            lines.append('')
+            lines.append(
+                f"{'file':<40}{'rows':>10}{'rows/s':>10}{'read s':>9}"
+                f"{'agg s':>8}{'write s':>9}{'queries':>9}{'peak RSS MB':>13}")
+            for file_path, record in report['files'].items():
+                name = file_path if len(file_path) <= 38 else '...' + file_path[-35:]
+                lines.append(
+                    f"{name:<40}{int(record.get('rows', 0)):>10}"
+                    f"{int(record.get('rows_per_second', 0)):>10}"
+                    f"{record.get('read_seconds', 0):>9.3f}"
+                    f"{record.get('aggregate_seconds', 0):>8.3f}"
+                    f"{record.get('write_seconds', 0):>9.3f}"
+                    f"{int(record.get('write_queries', 0)):>9}"
+                    f"{record.get('peak_rss_mb', 0):>13.1f}")
+
+        lines.append('')
+        lines.append(
+            f"Total {report['total_seconds']:.3f}s, peak RSS "
+            f"{report['peak_rss_mb']} MB (parsing {report['peak_rss_parse_mb']} MB)")
+        return lines
+
+    def stop(self):
+        if self.trace_memory:
+            tracemalloc.stop()
@@ -0,0 +1,80 @@
+"""
+Request-time ranking of batteries with custom metric weights.
+
+The stored scores blend normalized cycle count and SOH with fixed weights.
+For other weightings, each process keeps the min-max normalized metrics of
+every battery as one (battery x metric) matrix, rebuilt once per dataset
+version, so a custom ranking is a single matrix-vector product.
+"""
+import threading
+
+import numpy as np
+
+from .dataset import dataset_version
+from .models import Battery
+
+# Query parameter suffix -> (Battery field, direction). Metrics where lower
+# is better are flipped so 1 is always the best battery.
+RANKING_METRICS = {
+    'cycles': ('cycle_count', 1),
+    'soh': ('state_of_health', 1),
+    'discharge': ('overall_avg_discharge', 1),
+    'temp': ('overall_avg_temp', -1),
+}
+
+_lock = threading.Lock()
+_matrix = (None, None, None)
+
+
+def metric_matrix():
+    """
+    Returns (version, battery ids, normalized metrics) for the current
+    dataset version, building it with one query on first use. Metrics are
+    scaled to 0..1 across the batteries that have them, 0.5 when they are
+    all equal, and 0 when a battery lacks the metric. Nothing is cached
+    before the first version is published.
+    """
+    global _matrix
+    version = dataset_version()
+    if version is None:
+        return _build_matrix(version)
+    if _matrix[0] == version and _matrix[1] is not None:
+        return _matrix
+
+    with _lock:
+        if _matrix[0] != version or _matrix[1] is None:
+            _matrix = _build_matrix(version)
+    return _matrix
+
+
+def _build_matrix(version):
+    fields = [field for field, _ in RANKING_METRICS.values()]
+    rows = list(Battery.objects.order_by('pk').values_list('pk', *fields))
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    values = np.array(
+        [row[1:] for row in rows], dtype=float
+    ).reshape(len(rows), len(fields))
+
+    present = ~np.isnan(values)
+    low = values.min(axis=0, initial=np.inf, where=present)
+    span = values.max(axis=0, initial=-np.inf, where=present) - low
+    with np.errstate(invalid='ignore'):
+        normalized = np.where(
+            span > 0, (values - low) / np.where(span > 0, span, 1), 0.5)
+    directions = np.array(
+        [direction for _, direction in RANKING_METRICS.values()])
+    normalized = np.where(directions > 0, normalized, 1 - normalized)
+    normalized[~present] = 0.0
+    return version, ids, normalized
+
+
+def custom_scores(weights):
+    """
+    Scores every battery as the weighted mean of its normalized metrics.
+    `weights` maps RANKING_METRICS keys to non-negative weights with a
+    positive sum. Returns {battery id: score rounded to 4 places}.
+    """
+    _, ids, matrix = metric_matrix()
+    vector = np.array([weights.get(metric, 0.0) for metric in RANKING_METRICS])
+    scores = (matrix @ (vector / vector.sum())).round(4)
+    return dict(zip(ids.tolist(), scores.tolist()))
@@ -0,0 +1,102 @@
+"""
+Binary renderers for bulk analytical pulls of cycle series.
+
+Both renderers take the export payload built by `export_batteries`: a list
+of {'metadata': Battery summary fields, 'cycles': {field: [values]}}. Arrow
+IPC is offered when pyarrow is installed; the NumPy `.npz` renderer is
+always available.
+"""
+import io
+import json
+
+import numpy as np
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .series import SERIES_FIELDS
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+class BinarySeriesRenderer(BaseRenderer):
+    """
+    Base class for the export renderers. Anything that is not an export
+    payload, such as an error response, is rendered as JSON instead.
+    """
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, list):
+            response = (renderer_context or {}).get('response')
+            if response is not None:
+                response['Content-Type'] = JSONRenderer.media_type
+            return JSONRenderer().render(data)
+        return self.render_export(data)
+
+    def render_export(self, batteries):
+        raise NotImplementedError
+
+
+class ArrowStreamRenderer(BinarySeriesRenderer):
+    """
+    Arrow IPC stream with one record batch per battery. Each batch carries
+    the battery's summary fields as JSON in its custom metadata under
+    `battery`; the schema metadata repeats them for all batches, in order,
+    under `batteries`, for readers that drop batch metadata.
+    """
+    media_type = 'application/vnd.apache.arrow.stream'
+    format = 'arrow'
+
+    def render_export(self, batteries):
+        schema = pyarrow.schema(
+            [pyarrow.field('cycle_number', pyarrow.int64())]
+            + [pyarrow.field(name, pyarrow.float64()) for name in SERIES_FIELDS[1:]],
+            metadata={'batteries': json.dumps(
+                [battery['metadata'] for battery in batteries])},
+        )
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, schema) as writer:
+            for battery in batteries:
+                batch = pyarrow.record_batch(
+                    [
+                        pyarrow.array(battery['cycles'][field.name], type=field.type)
+                        for field in schema
+                    ],
+                    schema=schema,
+                )
+                writer.write_batch(batch, custom_metadata={
+                    'battery': json.dumps(battery['metadata'])})
+        return sink.getvalue().to_pybytes()
+
+
+class NpzRenderer(BinarySeriesRenderer):
+    """
+    NumPy `.npz` archive with one array per battery and field, named
+    `<id>/<field>`, plus the battery's summary fields as a JSON string in
+    `<id>/metadata`. Missing values are NaN.
+    """
+    media_type = 'application/x-npz'
+    format = 'npz'
+
+    def render_export(self, batteries):
+        arrays = {}
+        for battery in batteries:
+            prefix = battery['metadata']['id']
+            cycles = battery['cycles']
+            arrays[f'{prefix}/cycle_number'] = np.asarray(
+                cycles['cycle_number'], dtype=np.int64)
+            for name in SERIES_FIELDS[1:]:
+                arrays[f'{prefix}/{name}'] = np.asarray(
+                    cycles[name], dtype=np.float64)
+            arrays[f'{prefix}/metadata'] = np.array(
+                json.dumps(battery['metadata']))
+
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        return buffer.getvalue()
+
+
+BINARY_RENDERERS = [ArrowStreamRenderer, NpzRenderer] if pyarrow else [NpzRenderer]
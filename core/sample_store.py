@@ -0,0 +1,169 @@
+"""
+Compact store for the raw per-sample time series of each workbook.
+
+The per-cycle aggregation throws the individual samples away, so the loader
+also keeps the raw channels of every workbook as flat float32 files, sorted
+by cycle, plus a per-cycle offset index:
+
+    <store>/<content hash>/
+        cycles.npy       cycle numbers present, ascending (int64)
+        offsets.npy      sample offset of each cycle, plus the total (int64)
+        <channel>.f32    one little-endian float32 value per sample
+
+Entries are keyed by the workbook's content hash, so they never change once
+written and can be memory-mapped by any number of readers.
+
+Like `core.ingest`, this module does not touch the database.
+"""
+import os
+import shutil
+import tempfile
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# Stored channel -> source column in the workbook.
+SAMPLE_CHANNELS = {
+    'test_time': 'Test_Time(s)',
+    'current': 'Current(A)',
+    'voltage': 'Voltage(V)',
+    'temperature': 'Temperature (C)_1',
+    'charge_capacity': 'Charge_Capacity(Ah)',
+    'discharge_capacity': 'Discharge_Capacity(Ah)',
+}
+
+SAMPLE_DTYPE = np.dtype('<f4')
+CYCLE_DTYPE = np.dtype('<i8')
+
+
+def entry_dir(store_dir, content_hash):
+    return os.path.join(store_dir, content_hash)
+
+
+class SampleWriter:
+    """
+    Appends the samples of a workbook sheet by sheet and publishes the entry
+    on `commit`. Memory use is bounded by one sheet until the final sort,
+    which is skipped when the samples are already in cycle order.
+    """
+
+    def __init__(self, store_dir, content_hash):
+        self.target = entry_dir(store_dir, content_hash)
+        os.makedirs(store_dir, exist_ok=True)
+        self.scratch_dir = tempfile.mkdtemp(dir=store_dir)
+        self.files = {
+            name: open(os.path.join(self.scratch_dir, name + '.f32'), 'wb')
+            for name in SAMPLE_CHANNELS
+        }
+        self.files['cycle'] = open(
+            os.path.join(self.scratch_dir, 'cycle.i8'), 'wb')
+
+    def add(self, sheet):
+        """
+        Appends the rows of `sheet` that have a numeric `Cycle_Index`.
+        """
+        cycle_index = pd.to_numeric(sheet['Cycle_Index'], errors='coerce')
+        valid = cycle_index.notna().to_numpy()
+        self.files['cycle'].write(
+            cycle_index.to_numpy()[valid].astype(CYCLE_DTYPE).tobytes())
+        for name, column in SAMPLE_CHANNELS.items():
+            if column in sheet.columns:
+                values = pd.to_numeric(sheet[column], errors='coerce').to_numpy()
+            else:
+                values = np.full(len(sheet), np.nan)
+            self.files[name].write(values[valid].astype(SAMPLE_DTYPE).tobytes())
+
+    def commit(self):
+        for f in self.files.values():
+            f.close()
+
+        cycle_path = os.path.join(self.scratch_dir, 'cycle.i8')
+        cycle = np.fromfile(cycle_path, dtype=CYCLE_DTYPE)
+        if len(cycle) and np.any(np.diff(cycle) < 0):
+            order = np.argsort(cycle, kind='stable')
+            cycle = cycle[order]
+            for name in SAMPLE_CHANNELS:
+                path = os.path.join(self.scratch_dir, name + '.f32')
+                np.fromfile(path, dtype=SAMPLE_DTYPE)[order].tofile(path)
+        os.remove(cycle_path)
+
+        cycles, starts = np.unique(cycle, return_index=True)
+        np.save(os.path.join(self.scratch_dir, 'cycles.npy'), cycles)
+        np.save(os.path.join(self.scratch_dir, 'offsets.npy'),
+                np.append(starts, len(cycle)).astype(np.int64))
+
+        try:
+            os.rename(self.scratch_dir, self.target)
+        except OSError:
+            # Another process stored the same workbook first.
+            if not os.path.isdir(self.target):
+                raise
+
+    def discard(self):
+        for f in self.files.values():
+            f.close()
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+
+
+def open_entry(path):
+    """
+    Memory-maps a committed entry. Returns None if it does not exist.
+    """
+    if not os.path.isdir(path):
+        return None
+    return _map_entry(path)
+
+
+@lru_cache(maxsize=256)
+def _map_entry(path):
+    """
+    Entries are immutable, so the mapping of one that exists is cached for
+    the process lifetime. Missing entries are not cached, so an entry a
+    later load writes is picked up.
+    """
+    cycles = np.load(os.path.join(path, 'cycles.npy'))
+    offsets = np.load(os.path.join(path, 'offsets.npy'))
+    channels = {}
+    for name in SAMPLE_CHANNELS:
+        channel_path = os.path.join(path, name + '.f32')
+        channels[name] = (
+            np.memmap(channel_path, dtype=SAMPLE_DTYPE, mode='r')
+            if offsets[-1] else np.empty(0, dtype=SAMPLE_DTYPE))
+    return cycles, offsets, channels
+
+
+def read_samples(store_dir, content_hash, cycle_from, cycle_to):
+    """
+    Returns the samples of cycles `cycle_from`..`cycle_to` (inclusive) as
+    {'cycle_number': int64 array, <channel>: float32 array, ...}, slicing
+    the memory-mapped channels. Returns None if the workbook has no entry.
+    """
+    entry = open_entry(entry_dir(store_dir, content_hash))
+    if entry is None:
+        return None
+    cycles, offsets, channels = entry
+
+    first = np.searchsorted(cycles, cycle_from, side='left')
+    last = np.searchsorted(cycles, cycle_to, side='right')
+    start, stop = offsets[first], offsets[last]
+
+    samples = {
+        'cycle_number': np.repeat(
+            cycles[first:last], np.diff(offsets[first:last + 1])),
+    }
+    for name, values in channels.items():
+        samples[name] = values[start:stop]
+    return samples
+
+
+def prune(store_dir, keep_hashes):
+    """
+    Deletes the entries of workbooks that are no longer ingested, along with
+    scratch directories left by interrupted loads.
+    """
+    if not os.path.isdir(store_dir):
+        return
+    for name in os.listdir(store_dir):
+        if name not in keep_hashes:
+            shutil.rmtree(os.path.join(store_dir, name), ignore_errors=True)
@@ -1,12 +1,14 @@
+import numpy as np
 from rest_framework import serializers
 from .models import Battery, CycleData
+from .series import (
+    SERIES_FIELDS, cycle_values, downsample, downsampled_cycle_values)
 
 
 class CycleDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = CycleData
-        fields = ['cycle_number', 'discharge_capacity', 'charge_capacity', 'avg_current',
-                  'avg_voltage', 'avg_temp', 'max_temp', 'min_temp']
+        fields = SERIES_FIELDS
 
 
 class BatterySerializer(serializers.ModelSerializer):
@@ -17,6 +19,89 @@ class BatterySerializer(serializers.ModelSerializer):
         fields = ['id', 'file_name', 'cycle_count', 'cycles']
 
 
+def serialize_batteries(batteries, columnar=False, max_points=None):
+    """
+    Produces the same data as `BatterySerializer(batteries, many=True).data`
+    for a Battery queryset, but loads every cycle in a single ordered query
+    as value tuples instead of running the ModelSerializer pipeline per row.
+
+    With `columnar=True` each battery's `cycles` is a dict of parallel
+    lists, one per CycleData field, instead of a list of dicts. With
+    `max_points` each series is downsampled to at most that many cycles.
+    """
+    rows = list(batteries.values_list(*BatterySerializer.Meta.fields[:-1]))
+    if max_points:
+        values = downsampled_cycle_values([row[0] for row in rows], max_points)
+    else:
+        values = cycle_values(
+            CycleData.objects.filter(battery__in=batteries.values('pk')))
+    return with_cycles(rows, values, columnar)
+
+
+def serialize_battery(battery, columnar=False, max_points=None,
+                      cycle_filters=None, limit=None):
+    """
+    Single-battery counterpart of `serialize_batteries`.
+
+    `cycle_filters` are CycleData lookups on `cycle_number` restricting the
+    returned range. With `limit`, at most that many cycles are returned and
+    the data gains a `next_cursor`: the last returned cycle number if more
+    cycles follow, otherwise None.
+    """
+    row = (battery.id, battery.file_name, battery.cycle_count)
+    if max_points and not cycle_filters and limit is None:
+        return with_cycles(
+            [row], downsampled_cycle_values([battery.id], max_points),
+            columnar)[0]
+
+    cycles = CycleData.objects.filter(battery=battery, **(cycle_filters or {}))
+    series = cycle_values(
+        cycles, None if limit is None else limit + 1).get(battery.id, [])
+    return page_battery(row, series, columnar, max_points, limit)
+
+
+def page_battery(row, series, columnar=False, max_points=None, limit=None):
+    """
+    Builds the `serialize_battery` data from a battery's (id, file_name,
+    cycle_count) row and its filtered cycle value tuples, of which at most
+    `limit + 1` are needed when paging.
+    """
+    next_cursor = None
+    if limit is not None and len(series) > limit:
+        series = series[:limit]
+        next_cursor = series[-1][SERIES_FIELDS.index('cycle_number')]
+    if max_points:
+        series = downsample(series, max_points)
+
+    data = with_cycles([row], {row[0]: series}, columnar)[0]
+    if limit is not None:
+        data['next_cursor'] = next_cursor
+    return data
+
+
+def with_cycles(rows, values_by_battery, columnar):
+    fields = CycleDataSerializer.Meta.fields
+
+    if columnar:
+        def build(values):
+            # Transpose the value tuples into one list per field.
+            columns = list(zip(*values)) or [()] * len(fields)
+            return dict(zip(fields, map(list, columns)))
+    else:
+        def build(values):
+            return [dict(zip(fields, cycle)) for cycle in values]
+
+    return [
+        {
+            'id': battery_id,
+            'file_name': file_name,
+            'cycle_count': cycle_count,
+            'cycles': build(values_by_battery.get(battery_id, [])),
+        }
+        for battery_id, file_name, cycle_count in rows
+    ]
+
+
 class BatterySummarySerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -35,6 +120,10 @@ class BatterySummarySerializer(serializers.ModelSerializer):
             'balanced_score',
             'overall_avg_temp',
             'overall_avg_discharge',
+            'fade_model',
+            'fade_params',
+            'fade_r2',
+            'predicted_eol_cycle',
         ]
 
     def get_state_of_health(self, obj):
@@ -53,3 +142,49 @@ class BatterySummarySerializer(serializers.ModelSerializer):
             # Handle cases where a battery might not have cycle data
             return 0.0
         return 0.0
+
+
+def export_batteries(batteries, max_points=None):
+    """
+    Builds the payload for the binary renderers: one entry per battery with
+    its summary fields as `metadata` and its cycles in columnar layout.
+    """
+    summaries = {
+        summary['id']: summary
+        for summary in BatterySummarySerializer(batteries, many=True).data
+    }
+    return [
+        {'metadata': summaries[battery['id']], 'cycles': battery['cycles']}
+        for battery in serialize_batteries(
+            batteries, columnar=True, max_points=max_points)
+    ]
+
+
+def export_battery(battery, **options):
+    """
+    Single-battery counterpart of `export_batteries`; accepts the options of
+    `serialize_battery`. A `next_cursor` ends up in the metadata.
+    """
+    data = serialize_battery(battery, columnar=True, **options)
+    metadata = dict(BatterySummarySerializer(battery).data)
+    if 'next_cursor' in data:
+        metadata['next_cursor'] = data['next_cursor']
+    return [{'metadata': metadata, 'cycles': data['cycles']}]
+
+
+def serialize_samples(samples):
+    """
+    Converts the arrays returned by `read_samples` into JSON-ready lists.
+    float32 values are written with their shortest representation (0.1
+    rather than 0.10000000149011612) and NaN becomes None.
+    """
+    data = {}
+    for name, values in samples.items():
+        if np.issubdtype(values.dtype, np.floating):
+            data[name] = [
+                None if value == 'nan' else float(value)
+                for value in values.astype(str).tolist()
+            ]
+        else:
+            data[name] = values.tolist()
+    return data
@@ -0,0 +1,133 @@
+"""
+Loading of per-battery cycle series as plain value tuples.
+"""
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+from django.core.cache import cache
+
+from .dataset import dataset_version
+from .downsampling import lttb_indices
+from .models import CycleData
+
+# CycleData columns exposed by the API, in response order.
+SERIES_FIELDS = ['cycle_number', 'discharge_capacity', 'charge_capacity',
+                 'avg_current', 'avg_voltage', 'avg_temp', 'max_temp',
+                 'min_temp']
+
+
+def cycle_values(cycles, limit=None):
+    """
+    Runs one ordered values query over a CycleData queryset and returns
+    {battery_id: [value tuple per cycle]}, cycles in ascending order. The
+    ordering matches the (battery, cycle_number) unique index, so range
+    filters and `limit` are served by an index scan.
+    """
+    rows = cycles.order_by('battery_id', 'cycle_number').values_list(
+        'battery_id', *SERIES_FIELDS)
+    if limit is not None:
+        rows = rows[:limit]
+    return {
+        battery_id: [values[1:] for values in group]
+        for battery_id, group in groupby(rows.iterator(), itemgetter(0))
+    }
+
+
+def downsampled_cycle_values(battery_ids, max_points):
+    """
+    Like `cycle_values`, but each battery's series is reduced to at most
+    `max_points` cycles with LTTB on the capacity-fade curve. Results are
+    cached per (battery, max_points, dataset version), and only batteries
+    missing from the cache are queried. Nothing is cached before the first
+    version is published.
+    """
+    version = dataset_version()
+    keys = {
+        battery_id: f'cycles:{battery_id}:{max_points}:{version}'
+        for battery_id in battery_ids
+    }
+    cached = cache.get_many(keys.values()) if version is not None else {}
+    values = {
+        battery_id: cached[key]
+        for battery_id, key in keys.items() if key in cached
+    }
+
+    missing = [battery_id for battery_id in keys if battery_id not in values]
+    if missing:
+        fresh = cycle_values(CycleData.objects.filter(battery_id__in=missing))
+        for battery_id in missing:
+            values[battery_id] = downsample(
+                fresh.get(battery_id, []), max_points)
+        if version is not None:
+            cache.set_many(
+                {keys[battery_id]: values[battery_id] for battery_id in missing},
+                timeout=None)
+    return values
+
+
+def downsample(values, max_points):
+    """
+    Picks at most `max_points` of a battery's cycle value tuples, keeping the
+    first and last cycles and the knees of the discharge capacity curve.
+    """
+    if len(values) <= max_points:
+        return values
+    x_index = SERIES_FIELDS.index('cycle_number')
+    y_index = SERIES_FIELDS.index('discharge_capacity')
+    x = np.fromiter((v[x_index] for v in values), float, len(values))
+    y = np.fromiter((v[y_index] for v in values), float, len(values))
+    return [values[i] for i in lttb_indices(x, y, max_points)]
+
+
+def comparison_matrix(battery_ids, metric, normalize=False):
+    """
+    Aligns one CycleData field of several batteries on cycle number, from a
+    single values query. Returns (cycles, values): the sorted union of the
+    batteries' cycle numbers and a (battery x cycle) float array with one
+    row per id in `battery_ids`, NaN where a battery lacks the cycle.
+
+    With `normalize`, each row is divided by its value at the battery's
+    first usable cycle (the first with a positive discharge capacity).
+    Results are cached per (selection, metric, normalize, dataset version),
+    once a version has been published.
+    """
+    version = dataset_version()
+    key = 'compare:{}:{}:{}:{}'.format(
+        ','.join(map(str, battery_ids)), metric, int(normalize), version)
+    cached = cache.get(key) if version is not None else None
+    if cached is not None:
+        return cached
+
+    rows = np.array(
+        list(CycleData.objects.filter(battery_id__in=battery_ids)
+             .order_by('battery_id', 'cycle_number')
+             .values_list('battery_id', 'cycle_number', metric,
+                          'discharge_capacity')),
+        dtype=float,
+    ).reshape(-1, 4)
+
+    # Map each row's battery id to its position in the selection.
+    ids = np.asarray(battery_ids)
+    order = np.argsort(ids)
+    positions = order[np.searchsorted(ids[order], rows[:, 0])]
+    cycles, columns = np.unique(rows[:, 1], return_inverse=True)
+
+    values = np.full((len(ids), len(cycles)), np.nan)
+    values[positions, columns] = rows[:, 2]
+
+    if normalize:
+        usable = rows[:, 3] > 0
+        # Rows are in cycle order per battery, so the first occurrence of a
+        # position among the usable rows is that battery's first usable cycle.
+        first_positions, first_rows = np.unique(
+            positions[usable], return_index=True)
+        baseline = np.full(len(ids), np.nan)
+        baseline[first_positions] = rows[usable, 2][first_rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values /= baseline[:, None]
+
+    result = (cycles.astype(np.int64), values)
+    if version is not None:
+        cache.set(key, result, timeout=None)
+    return result
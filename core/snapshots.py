@@ -0,0 +1,154 @@
+"""
+Pre-rendered, pre-compressed API payloads.
+
+The dataset is static between loads, so `load_battery_data` renders the
+summary, every battery list and every battery detail once, together with
+gzip (and, when the `brotli` package is installed, brotli) variants. The
+read views serve these bytes directly for plain JSON requests.
+
+Snapshots live in SNAPSHOT_DIR, one directory per dataset version.
+"""
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.urls import reverse
+from rest_framework.renderers import JSONRenderer
+
+from .models import Battery
+from .serializers import (
+    BatterySummarySerializer, serialize_batteries, serialize_battery)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content-Encoding -> file suffix, in order of preference.
+ENCODINGS = {'br': '.br', 'gzip': '.gz'} if brotli else {'gzip': '.gz'}
+
+# Number of snapshot versions kept on disk, so requests that resolved the
+# previous version just before a load finished can still be served.
+KEEP_VERSIONS = 2
+
+
+def snapshot_dir(version):
+    slug = hashlib.sha256(version.encode()).hexdigest()[:16]
+    return os.path.join(settings.SNAPSHOT_DIR, slug)
+
+
+def snapshot_exists(version):
+    return os.path.isdir(snapshot_dir(version))
+
+
+def snapshot_payloads():
+    """
+    Yields (request path, JSON bytes) for every response that is
+    materialized, rendered exactly as the views would render them.
+    """
+    renderer = JSONRenderer()
+
+    summary = Battery.objects.order_by('voltage_type', 'battery_number')
+    yield reverse('battery-summary'), renderer.render(
+        BatterySummarySerializer(summary, many=True).data)
+
+    for voltage_type, _ in Battery.VOLTAGE_CHOICES:
+        batteries = Battery.objects.filter(voltage_type=voltage_type)
+        yield reverse('battery-list', args=[voltage_type]), renderer.render(
+            serialize_batteries(batteries))
+
+    for battery in Battery.objects.filter(battery_number__isnull=False):
+        path = reverse(
+            'battery-detail', args=[battery.voltage_type, battery.battery_number])
+        yield path, renderer.render(serialize_battery(battery))
+
+
+def materialize_snapshots(version):
+    """
+    Renders and compresses every snapshot payload for `version`, publishes
+    them with a directory rename, and prunes old versions. Returns the number
+    of payloads written.
+    """
+    os.makedirs(settings.SNAPSHOT_DIR, exist_ok=True)
+    scratch_dir = tempfile.mkdtemp(dir=settings.SNAPSHOT_DIR)
+    count = 0
+    try:
+        for path, content in snapshot_payloads():
+            base = os.path.join(scratch_dir, _file_name(path))
+            _write(base, content)
+            _write(base + ENCODINGS['gzip'], gzip.compress(content, mtime=0))
+            if brotli:
+                _write(base + ENCODINGS['br'], brotli.compress(content))
+            count += 1
+
+        target = snapshot_dir(version)
+        shutil.rmtree(target, ignore_errors=True)
+        os.rename(scratch_dir, target)
+    except BaseException:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+        raise
+
+    _prune(keep=target)
+    return count
+
+
+def read_snapshot(version, path, accept_encoding):
+    """
+    Returns (content, content encoding or None) for the snapshot of `path`,
+    picking the best encoding the client accepts, or None if there is no
+    snapshot for this path and version.
+    """
+    base = os.path.join(snapshot_dir(version), _file_name(path))
+    accepted = _accepted_encodings(accept_encoding)
+    for encoding, suffix in ENCODINGS.items():
+        if encoding in accepted:
+            try:
+                with open(base + suffix, 'rb') as f:
+                    return f.read(), encoding
+            except FileNotFoundError:
+                break
+    try:
+        with open(base, 'rb') as f:
+            return f.read(), None
+    except FileNotFoundError:
+        return None
+
+
+def _file_name(path):
+    return hashlib.sha256(path.encode()).hexdigest()[:32] + '.json'
+
+
+def _write(file_path, content):
+    with open(file_path, 'wb') as f:
+        f.write(content)
+
+
+def _accepted_encodings(accept_encoding):
+    accepted = set()
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _prune(keep):
+    """
+    Removes all but the newest KEEP_VERSIONS snapshot directories, plus any
+    scratch directories left behind by interrupted loads.
+    """
+    entries = [
+        os.path.join(settings.SNAPSHOT_DIR, name)
+        for name in os.listdir(settings.SNAPSHOT_DIR)
+    ]
+    entries = sorted(
+        (entry for entry in entries if os.path.isdir(entry)),
+        key=os.path.getmtime, reverse=True)
+    kept = [keep] + [entry for entry in entries if entry != keep][:KEEP_VERSIONS - 1]
+    for entry in entries:
+        if entry not in kept:
+            shutil.rmtree(entry, ignore_errors=True)
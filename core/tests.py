@@ -1,3 +1,909 @@
-from django.test import TestCase
+import gzip
+import os
+import tempfile
+import tracemalloc
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import snapshots
+from .analytics import eol_cycles, fit_fade_models, predict_linear
+from .dataset import dataset_version, publish_dataset_version
+from .downsampling import lttb_indices
+from .ingest import VOLTAGE_DIRS, summarize_workbook
+from .management.commands import load_battery_data
+from .management.commands.load_battery_data import SUMMARY_FIELDS, Command
+from .models import Battery, CycleData, SourceFile
+from .parse_cache import CACHE_FORMAT_VERSION
+from .sample_store import SampleWriter
+from .snapshots import materialize_snapshots
+from .views import BatterySamples
+
+
+def sample_sheet(cycles=3, rows_per_cycle=10, seed=0):
+    """
+    Raw samples shaped like a UL workbook sheet, with cumulative capacities
+    within each cycle.
+    """
+    rng = np.random.default_rng(seed)
+    rows = cycles * rows_per_cycle
+    step = np.tile(np.arange(1, rows_per_cycle + 1), cycles)
+    return pd.DataFrame({
+        'Cycle_Index': np.repeat(np.arange(1, cycles + 1), rows_per_cycle),
+        'Current(A)': rng.normal(1.0, 0.1, rows),
+        'Voltage(V)': rng.normal(3.7, 0.05, rows),
+        'Charge_Capacity(Ah)': step * 0.2,
+        'Discharge_Capacity(Ah)': step * 0.19,
+        'Temperature (C)_1': rng.normal(27.0, 0.5, rows),
+    })
+
+
+def write_workbook(path, sheets):
+    """Writes `sheets` as the channel sheets of a UL workbook at `path`."""
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({'Info': ['header sheet']}).to_excel(
+            writer, sheet_name='Info', index=False)
+        for i, sheet in enumerate(sheets, 1):
+            sheet.to_excel(writer, sheet_name=f'Channel_{i}', index=False)
+    return path
+
+
+class SummarizeWorkbookTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write_workbook(self, name, sheets):
+        return write_workbook(os.path.join(self.tmp.name, name), sheets)
+
+    def test_cycle_split_across_sheets_matches_single_sheet(self):
+        samples = sample_sheet()
+        # Row 15 falls in the middle of cycle 2.
+        split = self.write_workbook(
+            'split.xlsx', [samples.iloc[:15], samples.iloc[15:]])
+        whole = self.write_workbook('whole.xlsx', [samples])
+
+        folded = summarize_workbook(split, cache_dir=None)
+        expected = summarize_workbook(whole, cache_dir=None)
+
+        pd.testing.assert_frame_equal(folded, expected)
+        self.assertEqual(folded['Cycle_Index'].tolist(), [1, 2, 3])
+        cycle_2 = samples[samples['Cycle_Index'] == 2]
+        self.assertAlmostEqual(
+            folded.loc[1, 'avg_voltage'], cycle_2['Voltage(V)'].mean())
+        self.assertAlmostEqual(
+            folded.loc[1, 'discharge_capacity'],
+            cycle_2['Discharge_Capacity(Ah)'].max())
+
+    def test_profile_reports_memory_of_the_parsing_process(self):
+        path = self.write_workbook('whole.xlsx', [sample_sheet()])
+
+        profile = summarize_workbook(path, cache_dir=None).attrs['profile']
+        self.assertGreater(profile['peak_rss_mb'], 0)
+        self.assertNotIn('tracemalloc_peak_mb', profile)
+
+        profile = summarize_workbook(
+            path, cache_dir=None, trace_memory=True).attrs['profile']
+        self.assertGreater(profile['tracemalloc_peak_mb'], 0)
+        self.assertFalse(tracemalloc.is_tracing())
+
+
+class LoadBatteryDataTests(TestCase):
+    """
+    Runs the loader over synthetic workbooks in a temporary data directory.
+    """
+    FILE_NAME = 'Ba01_1C_TEST.xlsx'
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.data_dir = os.path.join(tmp.name, 'normal_voltage')
+        os.mkdir(self.data_dir)
+        self.sample_dir = os.path.join(tmp.name, 'samples')
+        patch = mock.patch.dict(
+            VOLTAGE_DIRS, {'normal': self.data_dir}, clear=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+        override = override_settings(
+            SAMPLE_STORE_DIR=self.sample_dir,
+            SNAPSHOT_DIR=os.path.join(tmp.name, 'snapshots'))
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.path = os.path.join(self.data_dir, self.FILE_NAME)
+        write_workbook(self.path, [sample_sheet(cycles=5)])
+        self.load()
+
+    def load(self):
+        out = StringIO()
+        call_command('load_battery_data', no_parse_cache=True, stdout=out)
+        return out.getvalue()
+
+    def cycles(self):
+        return list(CycleData.objects.order_by('cycle_number').values_list(
+            'cycle_number', 'discharge_capacity', 'avg_voltage'))
+
+    def test_first_load_publishes_the_battery(self):
+        battery = Battery.objects.get()
+        self.assertEqual(battery.battery_number, 1)
+        self.assertEqual(battery.cycle_count, 5)
+        self.assertEqual(len(self.cycles()), 5)
+        self.assertIsNotNone(battery.state_of_health)
+        self.assertIsNotNone(dataset_version())
+
+    def test_rerun_without_changes_does_nothing(self):
+        version, cycles = dataset_version(), self.cycles()
+
+        with CaptureQueriesContext(connection) as queries:
+            output = self.load()
+        self.assertIn('No data files changed', output)
+        self.assertEqual(dataset_version(), version)
+        self.assertEqual(self.cycles(), cycles)
+        self.assertFalse([
+            query for query in queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))])
+
+    def test_touched_file_only_updates_its_mtime(self):
+        version = dataset_version()
+        entry = SourceFile.objects.get()
+        os.utime(self.path, (entry.mtime + 60, entry.mtime + 60))
+
+        output = self.load()
+        self.assertIn('No data files changed', output)
+        self.assertEqual(dataset_version(), version)
+        touched = SourceFile.objects.get()
+        self.assertEqual(touched.mtime, entry.mtime + 60)
+        self.assertEqual(touched.content_hash, entry.content_hash)
+
+    def test_changed_file_replaces_its_cycles(self):
+        version = dataset_version()
+        old_hash = SourceFile.objects.get().content_hash
+        write_workbook(self.path, [sample_sheet(cycles=3, seed=1)])
+
+        self.load()
+        self.assertNotEqual(dataset_version(), version)
+        expected = summarize_workbook(self.path, cache_dir=None)
+        cycles = self.cycles()
+        self.assertEqual([cycle[0] for cycle in cycles], [1, 2, 3])
+        np.testing.assert_allclose(
+            [cycle[2] for cycle in cycles], expected['avg_voltage'])
+        self.assertEqual(Battery.objects.get().cycle_count, 3)
+
+        # The sample-store entry of the replaced file is pruned.
+        new_hash = SourceFile.objects.get().content_hash
+        self.assertNotEqual(new_hash, old_hash)
+        self.assertEqual(os.listdir(self.sample_dir), [new_hash])
+
+    def test_prunes_parse_cache_entries_of_replaced_files(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cache_dir = tmp.name
+        os.makedirs(os.path.join(cache_dir, 'tmp_interrupted'))
+        os.makedirs(os.path.join(cache_dir, 'f' * 64 + '.v1'))
+        with mock.patch.object(
+                load_battery_data, 'DEFAULT_CACHE_DIR', cache_dir):
+            call_command('load_battery_data', force=True, stdout=StringIO())
+            old_hash = SourceFile.objects.get().content_hash
+            self.assertEqual(
+                os.listdir(cache_dir), [f'{old_hash}.v{CACHE_FORMAT_VERSION}'])
+
+            write_workbook(self.path, [sample_sheet(cycles=3, seed=1)])
+            call_command('load_battery_data', stdout=StringIO())
+        new_hash = SourceFile.objects.get().content_hash
+        self.assertEqual(
+            os.listdir(cache_dir), [f'{new_hash}.v{CACHE_FORMAT_VERSION}'])
+
+    def test_rejects_a_batch_size_below_one(self):
+        for value in ('0', '-5', 'ten'):
+            with self.subTest(value=value):
+                with self.assertRaisesMessage(
+                        CommandError, 'must be a positive integer'):
+                    call_command('load_battery_data', '--batch-size', value)
+
+    def test_battery_without_usable_cycles_leaves_the_ranking(self):
+        other = os.path.join(self.data_dir, 'Ba02_1C_TEST.xlsx')
+        write_workbook(other, [sample_sheet(cycles=8, seed=2)])
+        self.load()
+        self.assertEqual(
+            Battery.objects.filter(state_of_health__isnull=False).count(), 2)
+
+        drained = sample_sheet(cycles=5)
+        drained['Discharge_Capacity(Ah)'] = 0.0
+        write_workbook(self.path, [drained])
+        version = dataset_version()
+        self.load()
+
+        self.assertNotEqual(dataset_version(), version)
+        battery = Battery.objects.get(battery_number=1)
+        for field in SUMMARY_FIELDS:
+            self.assertIsNone(getattr(battery, field), field)
+        # The other battery is now ranked on its own.
+        self.assertEqual(
+            Battery.objects.get(battery_number=2).balanced_score, 0.5)
+
+        write_workbook(other, [drained])
+        self.load()
+        self.assertFalse(
+            Battery.objects.filter(state_of_health__isnull=False).exists())
+
+    def test_failed_load_keeps_the_previous_generation(self):
+        version, cycles = dataset_version(), self.cycles()
+        entry = SourceFile.objects.get()
+        write_workbook(self.path, [sample_sheet(cycles=3, seed=1)])
+
+        with mock.patch.object(
+                Command, 'save_fade_fits', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                self.load()
+        self.assertEqual(dataset_version(), version)
+        self.assertEqual(self.cycles(), cycles)
+        self.assertEqual(Battery.objects.get().cycle_count, 5)
+        self.assertEqual(SourceFile.objects.get().content_hash, entry.content_hash)
+        self.assertIn(entry.content_hash, os.listdir(self.sample_dir))
+
+        # The next run picks the change up again.
+        self.load()
+        self.assertNotEqual(dataset_version(), version)
+        self.assertEqual(Battery.objects.get().cycle_count, 3)
+
+
+def create_battery(cycles=200, voltage_type='normal', battery_number=1):
+    """
+    A battery whose discharge capacity fades linearly with a dip every 50
+    cycles, so downsampling has knees to keep.
+    """
+    battery = Battery.objects.create(
+        file_name=f'B{voltage_type[0]}{battery_number:02d}_N20_OV1_{cycles}.xlsx',
+        voltage_type=voltage_type, battery_number=battery_number,
+        cycle_count=cycles, c_rate='N20', stress_test='OV1')
+    CycleData.objects.bulk_create(
+        CycleData(
+            battery=battery, cycle_number=n,
+            discharge_capacity=2.0 - 0.002 * n - (0.05 if n % 50 == 0 else 0),
+            charge_capacity=2.1 - 0.002 * n, avg_current=1.0,
+            avg_voltage=3.7, avg_temp=27.0, max_temp=30.0, min_temp=25.0)
+        for n in range(1, cycles + 1))
+    return battery
+
+
+class LTTBTests(SimpleTestCase):
+    def test_keeps_endpoints_and_returns_threshold_points(self):
+        x = np.arange(1000, dtype=float)
+        y = np.sin(x / 50) + np.random.default_rng(0).normal(0, 0.1, 1000)
+        for threshold in (3, 10, 137, 999):
+            with self.subTest(threshold=threshold):
+                indices = lttb_indices(x, y, threshold)
+                self.assertEqual(len(indices), threshold)
+                self.assertEqual(indices[0], 0)
+                self.assertEqual(indices[-1], 999)
+                self.assertTrue(np.all(np.diff(indices) > 0))
+
+    def test_short_series_is_returned_whole(self):
+        self.assertEqual(
+            lttb_indices([0, 1, 2], [5, 4, 3], 10).tolist(), [0, 1, 2])
+
+
+class APITestCase(TestCase):
+    """
+    Runs against an empty snapshot directory and cache, so responses always
+    come from the views under test.
+    """
+    def setUp(self):
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        override = override_settings(SNAPSHOT_DIR=snapshot_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+
+
+class MaxPointsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_battery()
+        self.url = reverse('battery-detail', args=['normal', 1])
+
+    def test_downsamples_to_max_points(self):
+        response = self.client.get(self.url, {'max_points': 20})
+        self.assertEqual(response.status_code, 200)
+        cycles = [cycle['cycle_number'] for cycle in response.json()['cycles']]
+        self.assertEqual(len(cycles), 20)
+        self.assertEqual((cycles[0], cycles[-1]), (1, 200))
+
+    def test_rejects_invalid_max_points(self):
+        for value in ('2', '0', '-5', 'many'):
+            with self.subTest(max_points=value):
+                response = self.client.get(self.url, {'max_points': value})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('max_points', response.json())
+
+
+class CursorPaginationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_battery(cycles=150)
+        self.url = reverse('battery-detail', args=['normal', 1])
+
+    def test_next_links_walk_every_cycle_once(self):
+        url, cycles, pages = f'{self.url}?limit=40', [], 0
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            cycles += [cycle['cycle_number'] for cycle in data['cycles']]
+            url = data['next']
+            pages += 1
+        self.assertEqual(cycles, list(range(1, 151)))
+        self.assertEqual(pages, 4)
+        self.assertIsNone(data['next_cursor'])
+
+    def test_cursor_resumes_after_the_given_cycle(self):
+        data = self.client.get(self.url, {'limit': 5, 'cursor': 100}).json()
+        self.assertEqual(
+            [cycle['cycle_number'] for cycle in data['cycles']],
+            [101, 102, 103, 104, 105])
+        self.assertEqual(data['next_cursor'], 105)
+
+    def test_rejects_invalid_cursor(self):
+        for value in ('-1', 'abc', '1.5'):
+            with self.subTest(cursor=value):
+                response = self.client.get(
+                    self.url, {'limit': 10, 'cursor': value})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('cursor', response.json())
+
+
+class ConditionalRequestTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_battery()
+        publish_dataset_version()
+        self.url = reverse('battery-summary')
+
+    def test_matching_etag_returns_304(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(response.content, b'')
+
+    def test_etag_changes_when_a_version_is_published(self):
+        etag = self.client.get(self.url)['ETag']
+        publish_dataset_version()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_304_and_cache_hit_only_read_the_version(self):
+        url = reverse('battery-detail', args=['normal', 1])
+        etag = self.client.get(url)['ETag']
+
+        for headers in ({'HTTP_IF_NONE_MATCH': etag}, {}):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, **headers)
+            self.assertIn(response.status_code, (200, 304))
+            self.assertEqual(response.cache_result, 'hit')
+            self.assertEqual(len(queries), 1, [q['sql'] for q in queries])
+            self.assertIn('core_datasetversion', queries[0]['sql'])
+
+    @override_settings(ALLOWED_HOSTS=['a.example', 'b.example'])
+    def test_cached_next_link_is_relative(self):
+        url = reverse('battery-detail', args=['normal', 1])
+        first = self.client.get(url, {'limit': 10}, HTTP_HOST='a.example')
+        second = self.client.get(url, {'limit': 10}, HTTP_HOST='b.example')
+        self.assertEqual(second.cache_result, 'hit')
+        self.assertTrue(first.json()['next'].startswith(url))
+
+
+class FadeModelTests(SimpleTestCase):
+    CYCLES = np.arange(1, 301, dtype=float)
+
+    def fit(self, curves, noise=1e-4):
+        """
+        Fits SOH `curves` ({battery id: SOH per cycle in CYCLES}) scaled to a
+        2 Ah cell, with relative noise.
+        """
+        rng = np.random.default_rng(0)
+        ids, cycles, capacities = [], [], []
+        for battery_id, soh in curves.items():
+            ids += [battery_id] * len(self.CYCLES)
+            cycles += list(self.CYCLES)
+            capacities += list(
+                2.0 * soh * (1 + rng.normal(0, noise, len(soh))))
+        return fit_fade_models(ids, cycles, capacities)
+
+    def test_recovers_the_generating_model(self):
+        n = self.CYCLES - 1
+        fits = self.fit({
+            1: 1 - 0.0008 * n,
+            2: 1 - 0.004 * n ** 0.8,
+            3: 0.9 * np.exp(-1e-4 * n) + 0.1 * np.exp(-0.05 * n),
+        })
+        self.assertEqual(fits['fade_model'].tolist(), [
+            'linear', 'power', 'double_exponential'])
+        params = fits.loc[3, 'fade_params']
+        self.assertAlmostEqual(params['b'], -0.05, delta=0.005)
+        self.assertAlmostEqual(params['d'], -1e-4, delta=1e-5)
+
+        # Cycles since the first one at which SOH reaches 80%.
+        expected = [250, (0.2 / 0.004) ** 1.25, np.log(0.9 / 0.8) / 1e-4]
+        for battery_id, cycles in zip(fits.index, expected):
+            with self.subTest(battery=battery_id):
+                self.assertAlmostEqual(
+                    fits.loc[battery_id, 'predicted_eol_cycle'], 1 + cycles,
+                    delta=0.01 * cycles + 2)
+
+    def test_rate_beyond_the_grid_falls_back_to_another_model(self):
+        n = self.CYCLES - 1
+        fits = self.fit({1: 0.9 * np.exp(-1e-4 * n) + 0.1 * np.exp(-3 * n)})
+        self.assertNotEqual(fits.loc[1, 'fade_model'], 'double_exponential')
+
+    def test_eol_cycles_bisects_the_crossing(self):
+        params = np.array([[1.0, -0.001], [1.0, -0.0001], [1.0, -0.00001]])
+        eol = eol_cycles(predict_linear, params, np.full(3, 300.0))
+        self.assertAlmostEqual(eol[0], 200, places=4)
+        # Beyond the observed span, but within EOL_HORIZON times it.
+        self.assertAlmostEqual(eol[1], 2000, places=3)
+        self.assertTrue(np.isnan(eol[2]))
+
+
+class WeightedRankingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('battery-summary')
+        for number, (cycles, soh) in enumerate([(300, 90.0), (100, 95.0)], 1):
+            Battery.objects.filter(pk=create_battery(
+                cycles=10, battery_number=number).pk).update(
+                    cycle_count=cycles, state_of_health=soh)
+
+    def scores(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [(b['battery_number'], b['custom_score']) for b in response.json()]
+
+    def test_orders_by_weighted_normalized_metrics(self):
+        self.assertEqual(self.scores(w_cycles=1), [(1, 1.0), (2, 0.0)])
+        self.assertEqual(self.scores(w_soh=3, w_cycles=1), [(2, 0.75), (1, 0.25)])
+
+    def test_missing_metric_counts_as_worst(self):
+        create_battery(cycles=10, battery_number=3)
+        Battery.objects.filter(battery_number=3).update(
+            cycle_count=200, state_of_health=None)
+        self.assertEqual(
+            self.scores(w_soh=1, w_cycles=1), [(1, 0.5), (2, 0.5), (3, 0.25)])
+
+    def test_rejects_bad_weights(self):
+        for params in ({'w_soh': '-1'}, {'w_soh': 'high'}, {'w_soh': 'inf'},
+                       {'w_soh': '0', 'w_cycles': '0'}):
+            with self.subTest(**params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 400)
+
+    def test_scores_batteries_loaded_after_the_first_ranking(self):
+        for published in (False, True):
+            with self.subTest(published=published):
+                if published:
+                    publish_dataset_version()
+                self.scores(w_cycles=1)
+                number = Battery.objects.count() + 1
+                create_battery(cycles=10, battery_number=number)
+                Battery.objects.filter(battery_number=number).update(
+                    cycle_count=1000 * number)
+                if published:
+                    publish_dataset_version()
+                self.assertEqual(self.scores(w_cycles=1)[0], (number, 1.0))
+
+
+class SummaryFilterTests(APITestCase):
+    BATTERIES = [
+        # number, voltage type, C-rate, balanced score, SOH
+        (1, 'normal', 'N10', 0.2, 80.0),
+        (2, 'normal', 'N20', 0.8, 95.0),
+        (3, 'reduced', 'N20', 0.5, 90.0),
+        (4, 'reduced', 'N10', None, None),
+        (5, 'reduced', 'N20', 0.5, 85.0),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('battery-summary')
+        for number, voltage_type, c_rate, score, soh in self.BATTERIES:
+            battery = create_battery(
+                cycles=5, voltage_type=voltage_type, battery_number=number)
+            Battery.objects.filter(pk=battery.pk).update(
+                c_rate=c_rate, balanced_score=score, state_of_health=soh)
+
+    def numbers(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [battery['battery_number'] for battery in response.json()]
+
+    def test_filters_by_category(self):
+        self.assertEqual(self.numbers(c_rate='N20'), [2, 3, 5])
+        self.assertEqual(
+            self.numbers(c_rate='N10, N20', voltage_type='reduced'), [3, 4, 5])
+        self.assertEqual(self.numbers(stress_test='EX2'), [])
+
+    def test_filters_by_inclusive_range(self):
+        self.assertEqual(self.numbers(min_balanced_score='0.5'), [2, 3, 5])
+        self.assertEqual(
+            self.numbers(min_state_of_health=85, max_state_of_health=90),
+            [3, 5])
+
+    def test_orders_by_score_leaving_out_missing_values(self):
+        # 3 and 5 tie, so they go by id, in the direction of the ordering.
+        self.assertEqual(self.numbers(ordering='-balanced_score'), [2, 5, 3, 1])
+        self.assertEqual(self.numbers(ordering='balanced_score'), [1, 3, 5, 2])
+        self.assertEqual(
+            self.numbers(ordering='-state_of_health', voltage_type='reduced'),
+            [3, 5])
+
+    def test_limit_cuts_the_list(self):
+        self.assertEqual(self.numbers(limit=2), [1, 2])
+        self.assertEqual(
+            self.numbers(ordering='-balanced_score', limit=1), [2])
+        self.assertEqual(self.numbers(limit=100), [1, 2, 3, 4, 5])
+
+    def test_rejects_invalid_parameters(self):
+        for params in ({'ordering': 'file_name'}, {'ordering': '-cycle_count'},
+                       {'min_balanced_score': 'high'},
+                       {'max_state_of_health': 'nan'},
+                       {'limit': '-1'}, {'limit': '0'}, {'limit': 'ten'},
+                       {'ordering': 'balanced_score', 'w_soh': '1'}):
+            with self.subTest(**params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(next(iter(params)), response.json())
+
+
+class CompareTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('battery-compare')
+        self.long = create_battery(cycles=5, battery_number=1)
+        self.short = create_battery(cycles=3, battery_number=2)
+        # A gap in the middle, and one cycle the others never reached.
+        CycleData.objects.filter(battery=self.short, cycle_number=2).delete()
+        CycleData.objects.filter(battery=self.short, cycle_number=3).update(
+            cycle_number=7, discharge_capacity=1.9)
+
+    def compare(self, battery_ids, **params):
+        response = self.client.get(self.url, {
+            'batteries': ','.join(map(str, battery_ids)), **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_aligns_batteries_with_different_cycles(self):
+        data = self.compare([self.short.pk, self.long.pk])
+        self.assertEqual(data['cycles'], [1, 2, 3, 4, 5, 7])
+        self.assertEqual(
+            [battery['id'] for battery in data['batteries']],
+            [self.short.pk, self.long.pk])
+        short, long = data['values']
+        self.assertEqual(
+            [value is None for value in short],
+            [False, True, True, True, True, False])
+        self.assertEqual(long[:5], [2.0 - 0.002 * n for n in range(1, 6)])
+        self.assertIsNone(long[5])
+        self.assertEqual(short[5], 1.9)
+
+    def test_normalizes_to_the_first_usable_cycle(self):
+        CycleData.objects.filter(battery=self.long, cycle_number=1).update(
+            discharge_capacity=0)
+        data = self.compare([self.short.pk, self.long.pk], normalize='true')
+        short, long = data['values']
+        self.assertEqual(short[0], 1.0)
+        self.assertAlmostEqual(short[5], 1.9 / 1.998)
+        # Cycle 1 has no capacity, so cycle 2 is the baseline.
+        self.assertEqual(long[1], 1.0)
+        self.assertEqual(long[0], 0.0)
+
+    def test_rejects_unknown_batteries_and_metrics(self):
+        for params in ({'batteries': f'{self.long.pk},999'},
+                       {'batteries': 'one,two'}, {'batteries': ''},
+                       {'batteries': str(self.long.pk), 'metric': 'cycle_number'}):
+            with self.subTest(**params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 400)
+
+
+class CohortTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.url = reverse('battery-cohorts')
+
+    def add(self, number, voltage_type, c_rate, stress_test, soh, cycles=5):
+        battery = create_battery(
+            cycles=cycles, voltage_type=voltage_type, battery_number=number)
+        Battery.objects.filter(pk=battery.pk).update(
+            c_rate=c_rate, stress_test=stress_test, state_of_health=soh)
+        return battery
+
+    def cohorts(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_no_batteries_gives_no_cohorts(self):
+        self.assertEqual(self.cohorts(), [])
+
+    def test_buckets_single_member_and_empty_cohorts(self):
+        self.add(1, 'normal', 'N20', 'OV1', 90.0)
+        self.add(2, 'normal', 'N20', 'OV1', 80.0)
+        self.add(3, 'reduced', 'N10', 'OV1', 85.0, cycles=3)
+        # No usable cycles and no statistics.
+        empty = self.add(4, 'reduced', 'N10', None, None)
+        CycleData.objects.filter(battery=empty).update(discharge_capacity=0)
+
+        pair, single, none = self.cohorts()
+        self.assertEqual(
+            [(c['voltage_type'], c['c_rate'], c['stress_test'], c['count'])
+             for c in (pair, single, none)],
+            [('normal', 'N20', 'OV1', 2), ('reduced', 'N10', 'OV1', 1),
+             ('reduced', 'N10', None, 1)])
+
+        self.assertEqual(pair['state_of_health']['mean'], 85.0)
+        self.assertEqual(pair['fade_curve']['count'], [2] * 5)
+        # The two fade identically, so the band closes around the mean.
+        self.assertEqual(pair['fade_curve']['mean'][0], 1.0)
+        self.assertEqual(pair['fade_curve']['lower'], pair['fade_curve']['mean'])
+        self.assertEqual(pair['fade_curve']['upper'], pair['fade_curve']['mean'])
+
+        # One battery: its own values, and no band around a mean of one.
+        self.assertEqual(single['state_of_health'], {
+            'mean': 85.0, 'median': 85.0, 'p10': 85.0, 'p90': 85.0})
+        self.assertEqual(single['fade_curve']['cycle_number'], [1, 2, 3])
+        self.assertEqual(single['fade_curve']['mean'][0], 1.0)
+        self.assertEqual(single['fade_curve']['lower'], [None] * 3)
+
+        self.assertEqual(none['state_of_health'], dict.fromkeys(
+            ('mean', 'median', 'p10', 'p90')))
+        self.assertEqual(none['fade_curve'], {
+            'cycle_number': [], 'count': [], 'mean': [], 'lower': [],
+            'upper': []})
+
+    def test_group_by_a_subset(self):
+        self.add(1, 'normal', 'N20', 'OV1', 90.0)
+        self.add(2, 'reduced', 'N20', 'EX2', 80.0)
+        self.add(3, 'reduced', 'N10', 'OV1', 70.0)
+        cohorts = self.cohorts(group_by='voltage_type')
+        self.assertEqual(
+            [(c['voltage_type'], c['count']) for c in cohorts],
+            [('normal', 1), ('reduced', 2)])
+        self.assertNotIn('c_rate', cohorts[0])
+        self.assertEqual(cohorts[1]['state_of_health']['median'], 75.0)
+
+    def test_without_usable_cycles(self):
+        battery = self.add(1, 'normal', 'N20', 'OV1', None)
+        CycleData.objects.filter(battery=battery).update(discharge_capacity=0)
+        (cohort,) = self.cohorts()
+        self.assertEqual(cohort['count'], 1)
+        self.assertEqual(cohort['fade_curve']['cycle_number'], [])
+
+    def test_rejects_unknown_group_by(self):
+        for group_by in ('battery_number', 'c_rate,cycle_count', ','):
+            with self.subTest(group_by=group_by):
+                response = self.client.get(self.url, {'group_by': group_by})
+                self.assertEqual(response.status_code, 400)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_battery(cycles=10)
+        publish_dataset_version()
+
+    def scrape(self):
+        """Returns {sample name with labels: value} from /api/metrics/."""
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line and not line.startswith('#'):
+                name, _, value = line.rpartition(' ')
+                samples[name] = float(value)
+        return samples
+
+    def test_counters_go_up_with_requests(self):
+        url = reverse('battery-detail', args=['normal', 1])
+        requests = ('battery_api_requests_total'
+                    '{endpoint="battery-detail",method="GET",status="200"}')
+        cache_hits = ('battery_api_cache_requests_total'
+                      '{endpoint="battery-detail",result="hit"}')
+        cache_misses = ('battery_api_cache_requests_total'
+                        '{endpoint="battery-detail",result="miss"}')
+        latency = ('battery_api_request_duration_seconds_count'
+                   '{endpoint="battery-detail"}')
+        queries = 'battery_api_db_queries_total{endpoint="battery-detail"}'
+        not_found = ('battery_api_requests_total'
+                     '{endpoint="battery-detail",method="GET",status="404"}')
+        before = self.scrape()
+
+        self.client.get(url)
+        self.client.get(url)
+        self.client.get(reverse('battery-detail', args=['normal', 99]))
+        after = self.scrape()
+
+        def increase(name):
+            return after.get(name, 0) - before.get(name, 0)
+
+        self.assertEqual(increase(requests), 2)
+        self.assertEqual(increase(not_found), 1)
+        self.assertEqual(increase(latency), 3)
+        self.assertEqual(increase(cache_misses), 2)
+        self.assertEqual(increase(cache_hits), 1)
+        self.assertGreater(increase(queries), 3)
+        # The previous scrape is counted too.
+        self.assertGreaterEqual(after[
+            'battery_api_requests_total'
+            '{endpoint="metrics",method="GET",status="200"}'], 1)
+
+
+class SampleTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        sample_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(sample_dir.cleanup)
+        override = override_settings(SAMPLE_STORE_DIR=sample_dir.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        battery = create_battery(cycles=3)
+        SourceFile.objects.create(
+            path='Ba01.xlsx', battery=battery, size=0, mtime=0,
+            content_hash='0' * 64, parser_version=1)
+        writer = SampleWriter(sample_dir.name, '0' * 64)
+        writer.add(sample_sheet(cycles=3, rows_per_cycle=4))
+        writer.commit()
+        publish_dataset_version()
+        self.url = reverse('battery-samples', args=['normal', 1])
+
+    def test_returns_the_samples_of_a_cycle_range(self):
+        response = self.client.get(self.url, {'cycle_from': 2, 'cycle_to': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()['samples']['cycle_number'], [2] * 4 + [3] * 4)
+        response = self.client.get(self.url, {'cycle': 1})
+        self.assertEqual(response.json()['samples']['cycle_number'], [1] * 4)
+
+    def test_rejects_invalid_and_oversized_ranges(self):
+        longest = BatterySamples.MAX_CYCLES
+        for params in ({}, {'cycle': '-1'}, {'cycle_from': 'one'},
+                       {'cycle_from': '5', 'cycle_to': '4'},
+                       {'cycle_from': '1', 'cycle_to': str(longest + 1)}):
+            with self.subTest(**params):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            self.url, {'cycle_from': '1', 'cycle_to': str(longest)})
+        self.assertEqual(response.status_code, 200)
+
+    def test_oversized_bodies_are_not_cached(self):
+        params = {'cycle_from': 1, 'cycle_to': 3}
+        self.assertEqual(self.client.get(self.url, params).cache_result, 'miss')
+        with override_settings(RESPONSE_CACHE_MAX_BYTES=100):
+            cache.clear()
+            for _ in range(2):
+                response = self.client.get(self.url, params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.cache_result, 'miss')
+        self.assertEqual(self.client.get(self.url, params).cache_result, 'miss')
+        self.assertEqual(self.client.get(self.url, params).cache_result, 'hit')
+
+
+class InMemoryDatasetTests(APITestCase):
+    URLS = [
+        ('battery-summary', [], {}),
+        ('battery-summary', [], {'w_soh': 1, 'w_cycles': 2}),
+        ('battery-list', ['normal'], {}),
+        ('battery-list', ['normal'], {'layout': 'columnar', 'max_points': 10}),
+        ('battery-detail', ['normal', 2], {}),
+        ('battery-detail', ['normal', 2], {'limit': 25, 'cursor': 40}),
+        ('battery-detail', ['normal', 2], {'cycle_from': 10, 'cycle_to': 60,
+                                           'max_points': 8}),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        for number, cycles in enumerate([120, 80, 60], 1):
+            create_battery(cycles=cycles, battery_number=number)
+        Battery.objects.filter(battery_number=2).update(state_of_health=91.5)
+        create_battery(cycles=30, voltage_type='reduced')
+
+    def get_all(self):
+        responses = []
+        for name, args, params in self.URLS:
+            response = self.client.get(reverse(name, args=args), params)
+            self.assertEqual(response.status_code, 200)
+            responses.append(response.content)
+        return responses
+
+    def test_matches_the_database_backed_responses(self):
+        with self.settings(IN_MEMORY_DATASET=False):
+            expected = self.get_all()
+        with self.settings(IN_MEMORY_DATASET=True):
+            actual = self.get_all()
+        for (name, _, params), body, expected_body in zip(
+                self.URLS, actual, expected):
+            with self.subTest(name, **params):
+                self.assertEqual(body, expected_body)
+
+    @override_settings(IN_MEMORY_DATASET=True)
+    def test_sees_new_rows_before_a_version_is_published(self):
+        url = reverse('battery-summary')
+        self.assertEqual(len(self.client.get(url).json()), 4)
+        create_battery(cycles=10, battery_number=9)
+        self.assertEqual(len(self.client.get(url).json()), 5)
+
+
+class SnapshotTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        create_battery(cycles=40)
+        create_battery(cycles=30, battery_number=2)
+        self.version = publish_dataset_version()
+        materialize_snapshots(self.version)
+        self.url = reverse('battery-list', args=['normal'])
+
+    def test_serves_json_requests_from_the_snapshot(self):
+        for accept in ('*/*', 'application/json', 'application/json, */*;q=0.5'):
+            with self.subTest(accept=accept):
+                cache.clear()
+                response = self.client.get(self.url, HTTP_ACCEPT=accept)
+                self.assertEqual(response.cache_result, 'hit')
+                self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_binary_accept_with_wildcard_runs_the_view(self):
+        response = self.client.get(
+            self.url, HTTP_ACCEPT='application/x-npz, */*;q=0.1')
+        self.assertEqual(response.cache_result, 'miss')
+        self.assertEqual(response['Content-Type'], 'application/x-npz')
+
+    def test_browsable_api_runs_the_view(self):
+        response = self.client.get(
+            self.url, HTTP_ACCEPT='text/html,application/xhtml+xml,*/*;q=0.8')
+        self.assertEqual(response.cache_result, 'miss')
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+
+    def live_body(self, url):
+        """Renders `url` with no snapshot to serve it from."""
+        with tempfile.TemporaryDirectory() as empty, override_settings(
+                SNAPSHOT_DIR=empty):
+            cache.clear()
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.cache_result, 'miss')
+        return response.content
+
+    def test_snapshot_bytes_match_the_live_response(self):
+        decoders = {None: bytes, 'gzip': gzip.decompress}
+        accepts = [('identity', None), ('gzip, deflate', 'gzip')]
+        if snapshots.brotli:
+            decoders['br'] = snapshots.brotli.decompress
+            accepts.append(('gzip, deflate, br', 'br'))
+        urls = [reverse('battery-summary'), self.url,
+                reverse('battery-list', args=['reduced'])]
+        for url in urls:
+            live = self.live_body(url)
+            for accept_encoding, encoding in accepts:
+                with self.subTest(url=url, accept_encoding=accept_encoding):
+                    cache.clear()
+                    response = self.client.get(
+                        url, HTTP_ACCEPT='application/json',
+                        HTTP_ACCEPT_ENCODING=accept_encoding)
+                    self.assertEqual(response.cache_result, 'hit')
+                    self.assertEqual(response.get('Content-Encoding'), encoding)
+                    self.assertEqual(decoders[encoding](response.content), live)
@@ -1,5 +1,8 @@
 from django.urls import path
-from .views import BatteryList, BatteryDetail, BatterySummaryView,  health_check
+from . import async_views
+from .views import (
+    BatteryCohorts, BatteryCompare, BatteryList, BatteryDetail, BatterySamples,
+    BatterySummaryView, health_check, metrics)
 
 urlpatterns = [
     path('batteries/<str:voltage_type>/',
@@ -8,7 +11,26 @@ urlpatterns = [
     path('batteries/<str:voltage_type>/<int:battery_number>/',
          BatteryDetail.as_view(), name='battery-detail'),
 
+    path('batteries/<str:voltage_type>/<int:battery_number>/samples/',
+         BatterySamples.as_view(), name='battery-samples'),
+
+    path('compare/', BatteryCompare.as_view(), name='battery-compare'),
+
+    path('cohorts/', BatteryCohorts.as_view(), name='battery-cohorts'),
+
     path('summary/', BatterySummaryView.as_view(), name='battery-summary'),
 
     path('health-check/', health_check, name='health_check'),
+
+    path('metrics/', metrics, name='metrics'),
+
+    # Async variants for ASGI deployments; the battery list is streamed.
+    path('async/batteries/<str:voltage_type>/',
+         async_views.battery_list, name='async-battery-list'),
+
+    path('async/batteries/<str:voltage_type>/<int:battery_number>/',
+         async_views.battery_detail, name='async-battery-detail'),
+
+    path('async/summary/',
+         async_views.battery_summary, name='async-battery-summary'),
 ]
@@ -1,17 +1,109 @@
-import os
+import math
 
+import numpy as np
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
 from rest_framework import generics
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
+from .caching import dataset_cached
+from . import memstore
+from .cohorts import COHORT_FIELDS, cohort_statistics
+from .dataset import dataset_version
+from .metrics import registry
 from .models import Battery
-from .serializers import BatterySerializer, BatterySummarySerializer
+from .ranking import RANKING_METRICS, custom_scores
+from .renderers import BINARY_RENDERERS, BinarySeriesRenderer
+from .serializers import (
+    BatterySerializer, BatterySummarySerializer, export_batteries,
+    export_battery, serialize_batteries, serialize_battery, serialize_samples)
+from .sample_store import read_samples
+from .series import SERIES_FIELDS, comparison_matrix
 
 
-class BatteryList(generics.ListAPIView):
+class QueryParamsMixin:
+    """
+    Parses numeric query parameters. Absent parameters give None, and
+    invalid ones a 400 response naming the parameter.
+    """
+
+    def get_int_param(self, name, minimum, maximum=None):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            value = None
+        if maximum is None:
+            if value is None or value < minimum:
+                raise ValidationError(
+                    {name: f'Must be an integer of at least {minimum}.'})
+        elif value is None or not minimum <= value <= maximum:
+            raise ValidationError(
+                {name: f'Must be an integer from {minimum} to {maximum}.'})
+        return value
+
+    def get_float_param(self, name, minimum=None):
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        try:
+            value = float(value)
+        except ValueError:
+            value = math.nan
+        if not math.isfinite(value):
+            raise ValidationError({name: 'Must be a number.'})
+        if minimum is not None and value < minimum:
+            raise ValidationError(
+                {name: f'Must be a number of at least {minimum}.'})
+        return value
+
+
+class CycleSeriesMixin(QueryParamsMixin):
+    """
+    Parses the query parameters shared by the endpoints that return
+    cycle-by-cycle data, and offers the binary export formats alongside
+    JSON.
+    """
+    LAYOUTS = ('rows', 'columnar')
+    renderer_classes = [
+        *api_settings.DEFAULT_RENDERER_CLASSES, *BINARY_RENDERERS]
+
+    def wants_export(self):
+        return isinstance(self.request.accepted_renderer, BinarySeriesRenderer)
+
+    def get_layout(self):
+        layout = self.request.query_params.get('layout', 'rows')
+        if layout not in self.LAYOUTS:
+            raise ValidationError(
+                {'layout': f"Must be one of: {', '.join(self.LAYOUTS)}."})
+        return layout
+
+    def get_max_points(self):
+        return self.get_int_param('max_points', 3)
+
+    def get_series_options(self):
+        return {
+            'columnar': self.get_layout() == 'columnar',
+            'max_points': self.get_max_points(),
+        }
+
+
+@method_decorator(dataset_cached, name='dispatch')
+class BatteryList(CycleSeriesMixin, generics.ListAPIView):
     """
     Returns a list of batteries for a specific voltage type,
     including detailed cycle-by-cycle data.
+
+    `?layout=columnar` returns each battery's cycles as parallel arrays and
+    `?max_points=N` downsamples each series to at most N cycles. Binary
+    exports are negotiated through `Accept` or `?format=arrow|npz`.
     """
     serializer_class = BatterySerializer
 
@@ -19,17 +111,42 @@ class BatteryList(generics.ListAPIView):
         voltage_type = self.kwargs['voltage_type']
         return Battery.objects.filter(voltage_type=voltage_type)
 
+    def list(self, request, *args, **kwargs):
+        options = self.get_series_options()
+        if settings.IN_MEMORY_DATASET:
+            dataset = memstore.current()
+            voltage_type = self.kwargs['voltage_type']
+            if self.wants_export():
+                return Response(dataset.export_batteries(
+                    voltage_type, max_points=options['max_points']))
+            return Response(dataset.serialize_batteries(voltage_type, **options))
 
-class BatteryDetail(generics.RetrieveAPIView):
+        if self.wants_export():
+            return Response(export_batteries(
+                self.get_queryset(), max_points=options['max_points']))
+        return Response(serialize_batteries(self.get_queryset(), **options))
+
+
+@method_decorator(dataset_cached, name='dispatch')
+class BatteryDetail(CycleSeriesMixin, generics.RetrieveAPIView):
     """
     Returns the full details for a single battery, identified by its
     voltage type and battery number in the URL.
+
+    `?layout=columnar` returns the cycles as parallel arrays and
+    `?max_points=N` downsamples the series to at most N cycles. Binary
+    exports are negotiated through `Accept` or `?format=arrow|npz`.
+
+    `?cycle_from=` / `?cycle_to=` (inclusive) restrict the cycle range.
+    `?limit=N` pages through the cycles in order: the response then carries
+    a `next_cursor` (the last cycle returned, or null on the last page) and
+    a `next` link, and `?cursor=` returns the cycles after that one. The
+    link is relative, as the response is cached for every host.
     """
     queryset = Battery.objects.all()
     serializer_class = BatterySerializer
 
     def get_object(self):
-        from django.shortcuts import get_object_or_404
         queryset = self.get_queryset()
         obj = get_object_or_404(
             queryset,
@@ -38,28 +155,289 @@ class BatteryDetail(generics.RetrieveAPIView):
         )
         return obj
 
+    def get_cycle_filters(self):
+        lookups = {
+            'cycle_from': 'cycle_number__gte',
+            'cycle_to': 'cycle_number__lte',
+            'cursor': 'cycle_number__gt',
+        }
+        filters = {}
+        for param, lookup in lookups.items():
+            value = self.get_int_param(param, 0)
+            if value is not None:
+                filters[lookup] = value
+        return filters
+
+    def retrieve(self, request, *args, **kwargs):
+        options = self.get_series_options()
+        cycle_filters = self.get_cycle_filters()
+        limit = self.get_int_param('limit', 1)
+
+        if settings.IN_MEMORY_DATASET:
+            dataset = memstore.current()
+            battery = dataset.get(
+                self.kwargs['voltage_type'], self.kwargs['battery_number'])
+            export, serialize = dataset.export_battery, dataset.serialize_battery
+        else:
+            battery = self.get_object()
+            export, serialize = export_battery, serialize_battery
+
+        if self.wants_export():
+            return Response(export(
+                battery, cycle_filters=cycle_filters, limit=limit,
+                max_points=options['max_points']))
+
+        data = serialize(
+            battery, cycle_filters=cycle_filters, limit=limit, **options)
+        if limit is not None:
+            next_cursor = data['next_cursor']
+            data['next'] = None if next_cursor is None else replace_query_param(
+                request.get_full_path(), 'cursor', next_cursor)
+        return Response(data)
+
+
+@method_decorator(dataset_cached, name='dispatch')
+class BatterySamples(QueryParamsMixin, generics.RetrieveAPIView):
+    """
+    Returns the raw samples (test time, current, voltage, temperature and
+    capacities) recorded within one cycle, `?cycle=N`, or a range of at most
+    MAX_CYCLES cycles, `?cycle_from=` / `?cycle_to=` (inclusive). The samples
+    come from the memory-mapped sample store, not the database.
+    """
+    queryset = Battery.objects.select_related('source_file')
+    MAX_CYCLES = 100
+
+    def get_cycle_range(self):
+        cycle = self.get_int_param('cycle', 0)
+        if cycle is not None:
+            return cycle, cycle
+        cycle_from = self.get_int_param('cycle_from', 0)
+        if cycle_from is None:
+            raise ValidationError(
+                {'cycle': 'Either cycle or cycle_from is required.'})
+        cycle_to = self.get_int_param(
+            'cycle_to', cycle_from, maximum=cycle_from + self.MAX_CYCLES - 1)
+        return cycle_from, cycle_from if cycle_to is None else cycle_to
+
+    def retrieve(self, request, *args, **kwargs):
+        cycle_from, cycle_to = self.get_cycle_range()
+        battery = get_object_or_404(
+            self.get_queryset(),
+            voltage_type=self.kwargs['voltage_type'],
+            battery_number=self.kwargs['battery_number'],
+        )
+        source_file = getattr(battery, 'source_file', None)
+        samples = source_file and read_samples(
+            settings.SAMPLE_STORE_DIR, source_file.content_hash,
+            cycle_from, cycle_to)
+        if samples is None:
+            raise Http404('No raw samples are stored for this battery.')
+        return Response({
+            'id': battery.id,
+            'file_name': battery.file_name,
+            'cycle_from': cycle_from,
+            'cycle_to': cycle_to,
+            'samples': serialize_samples(samples),
+        })
+
+
+@method_decorator(dataset_cached, name='dispatch')
+class BatteryCompare(generics.GenericAPIView):
+    """
+    Returns one cycle metric of several batteries as a dense matrix aligned
+    on cycle number: `?batteries=3,7,11&metric=discharge_capacity`.
+    `values` has one row per battery, in the requested order, and one column
+    per entry of `cycles`, with null where a battery has no such cycle.
+    `?normalize=true` divides each row by its value at the battery's first
+    usable cycle.
+    """
+    queryset = Battery.objects.all()
+    METRICS = SERIES_FIELDS[1:]
+
+    def get_battery_ids(self):
+        value = self.request.query_params.get('batteries', '')
+        try:
+            battery_ids = [int(part) for part in value.split(',') if part.strip()]
+        except ValueError:
+            battery_ids = None
+        if not battery_ids:
+            raise ValidationError(
+                {'batteries': 'Must be a comma-separated list of battery ids.'})
+        # Drop repeats, keeping the requested order.
+        return list(dict.fromkeys(battery_ids))
+
+    def get_metric(self):
+        metric = self.request.query_params.get('metric', 'discharge_capacity')
+        if metric not in self.METRICS:
+            raise ValidationError(
+                {'metric': f"Must be one of: {', '.join(self.METRICS)}."})
+        return metric
+
+    def get(self, request, *args, **kwargs):
+        battery_ids = self.get_battery_ids()
+        metric = self.get_metric()
+        normalize = request.query_params.get('normalize', '').lower() in (
+            '1', 'true', 'yes')
+
+        batteries = {
+            battery['id']: battery
+            for battery in self.get_queryset().filter(pk__in=battery_ids).values(
+                'id', 'file_name', 'voltage_type', 'battery_number')
+        }
+        missing = [pk for pk in battery_ids if pk not in batteries]
+        if missing:
+            raise ValidationError(
+                {'batteries': f"Unknown battery ids: {', '.join(map(str, missing))}."})
+
+        cycles, values = comparison_matrix(battery_ids, metric, normalize)
+        values = np.where(np.isfinite(values), values, None)
+        return Response({
+            'metric': metric,
+            'normalized': normalize,
+            'batteries': [batteries[pk] for pk in battery_ids],
+            'cycles': cycles.tolist(),
+            'values': values.tolist(),
+        })
+
+
+@method_decorator(dataset_cached, name='dispatch')
+class BatteryCohorts(generics.GenericAPIView):
+    """
+    Returns statistics per cohort of batteries sharing the fields in
+    `?group_by=` (a comma-separated subset of voltage_type, c_rate and
+    stress_test; all three by default): the battery count, the spread of
+    SOH, cycle count and average temperature, and the cohort's mean
+    capacity-fade curve with a 95% confidence band.
+    """
+    queryset = Battery.objects.all()
+
+    def get_group_by(self):
+        value = self.request.query_params.get('group_by')
+        if value is None:
+            return COHORT_FIELDS
+        group_by = [field.strip() for field in value.split(',') if field.strip()]
+        if not group_by or not set(group_by) <= set(COHORT_FIELDS):
+            raise ValidationError(
+                {'group_by': f"Must be a subset of: {', '.join(COHORT_FIELDS)}."})
+        # A fixed field order keeps equivalent requests on one cache entry.
+        return [field for field in COHORT_FIELDS if field in group_by]
+
+    def get(self, request, *args, **kwargs):
+        return Response(cohort_statistics(self.get_group_by()))
+
 
-class BatterySummaryView(generics.ListAPIView):
+@method_decorator(dataset_cached, name='dispatch')
+class BatterySummaryView(QueryParamsMixin, generics.ListAPIView):
     """
     This view provides a high-level summary of all batteries.
     All data is pre-calculated and served directly from the model.
+
+    Weights such as `?w_cycles=0.6&w_soh=0.4` (see RANKING_METRICS) add a
+    `custom_score` to every battery and order the list by it, best first.
+
+    The list can be filtered by category (`?c_rate=N10,N20`) and by range
+    (`?min_balanced_score=0.5&max_state_of_health=90`), ordered by a score
+    (`?ordering=-balanced_score`) and cut to the first N (`?limit=10`), all
+    in SQL.
     """
     queryset = Battery.objects.order_by('voltage_type', 'battery_number')
     serializer_class = BatterySummarySerializer
+    CATEGORY_FIELDS = ('voltage_type', 'c_rate', 'stress_test')
+    # Each has an index ending in id; see Battery.Meta.
+    SCORE_FIELDS = (
+        'state_of_health', 'durability_score', 'resilience_score',
+        'balanced_score')
+
+    def get_filters(self):
+        """
+        Returns the queryset filters given by the category and range
+        parameters.
+        """
+        params = self.request.query_params
+        filters = {}
+        for field in self.CATEGORY_FIELDS:
+            value = params.get(field)
+            if value is not None:
+                filters[f'{field}__in'] = [
+                    item.strip() for item in value.split(',') if item.strip()]
+        for field in self.SCORE_FIELDS:
+            for bound, lookup in (('min', 'gte'), ('max', 'lte')):
+                value = self.get_float_param(f'{bound}_{field}')
+                if value is not None:
+                    filters[f'{field}__{lookup}'] = value
+        return filters
+
+    def get_ordering(self):
+        ordering = self.request.query_params.get('ordering')
+        if ordering is not None and ordering.lstrip('-') not in self.SCORE_FIELDS:
+            raise ValidationError({'ordering': 'Must be one of: {}, optionally '
+                                   "prefixed with '-'.".format(
+                                       ', '.join(self.SCORE_FIELDS))})
+        return ordering
+
+    def filter_queryset(self, queryset):
+        queryset = queryset.filter(**self.get_filters())
+        ordering = self.get_ordering()
+        if ordering:
+            # Batteries without the value are left out of a ranking, and ties
+            # go by id, so the order matches the index.
+            field = ordering.lstrip('-')
+            queryset = queryset.filter(**{f'{field}__isnull': False}).order_by(
+                ordering, '-pk' if ordering.startswith('-') else 'pk')
+        return queryset
+
+    def get_weights(self):
+        weights = {}
+        for metric in RANKING_METRICS:
+            value = self.get_float_param(f'w_{metric}', minimum=0)
+            if value is not None:
+                weights[metric] = value
+        if weights and not sum(weights.values()) > 0:
+            raise ValidationError(
+                {'weights': 'At least one weight must be positive.'})
+        return weights
+
+    def list(self, request, *args, **kwargs):
+        weights = self.get_weights()
+        limit = self.get_int_param('limit', 1)
+        if weights and self.get_ordering():
+            raise ValidationError(
+                {'ordering': 'Cannot be combined with weights, which order '
+                             'the list by custom_score.'})
+
+        # Filtered and ranked requests go to the database even in memory
+        # mode, where the indexes answer them.
+        if settings.IN_MEMORY_DATASET and not (
+                self.get_filters() or self.get_ordering()):
+            summaries = memstore.current().summaries
+            if not weights:
+                return Response(summaries[:limit])
+            data = [dict(summary) for summary in summaries]
+        else:
+            queryset = self.filter_queryset(self.get_queryset())
+            if not weights:
+                return Response(
+                    self.get_serializer(queryset[:limit], many=True).data)
+            data = self.get_serializer(queryset, many=True).data
+
+        scores = custom_scores(weights)
+        for battery in data:
+            battery['custom_score'] = scores.get(battery['id'])
+        data.sort(key=lambda battery: -(battery['custom_score'] or 0))
+        return Response(data[:limit])
 
 
 def health_check(request):
     """
     An endpoint to provide the last data update timestamp.
     """
-    timestamp_file_path = os.path.join(settings.BASE_DIR, 'last_update.txt')
-    last_updated = None
+    return JsonResponse({'last_updated': dataset_version()})
 
-    try:
-        with open(timestamp_file_path, 'r') as f:
-            last_updated = f.read().strip()
-    except FileNotFoundError:
-        # This will be the case if the load script has never been run
-        pass
 
-    return JsonResponse({'last_updated': last_updated})
+def metrics(request):
+    """
+    The request metrics of this process, in the Prometheus text format.
+    """
+    return HttpResponse(
+        registry.exposition(),
+        content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,6 +1,9 @@
-import pandas as pd
 import os
 
+import pandas as pd
+
+from core.parse_cache import iter_sheets
+
 print("--- Starting Data File Analysis ---")
 
 # Define the directories to scan
@@ -27,17 +30,19 @@ for directory in data_dirs:
             file_path = os.path.join(directory, filename)
 
             try:
-                # Load all sheets from the Excel file into a dictionary of DataFrames
-                all_sheets = pd.read_excel(file_path, sheet_name=None)
-                # Concatenate them all into a single DataFrame
-                df = pd.concat(all_sheets.values(), ignore_index=True)
-
-                # Get the total number of rows (data points)
-                total_data_points = len(df)
+                # Stream the sheets one at a time (served from the parse
+                # cache after the first run), keeping only 'Cycle_Index'
+                total_data_points = 0
+                cycle_indexes = []
+                for sheet in iter_sheets(file_path, columns=['Cycle_Index']):
+                    # Get the total number of rows (data points)
+                    total_data_points += len(sheet)
+                    if 'Cycle_Index' in sheet.columns:
+                        cycle_indexes.append(sheet['Cycle_Index'])
 
                 # Get the number of unique cycles from the 'Cycle_Index' column
                 # This is more robust than just getting the max value
-                total_cycles = df['Cycle_Index'].nunique()
+                total_cycles = pd.concat(cycle_indexes).nunique()
 
                 all_results.append({
                     "filename": filename,